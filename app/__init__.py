@@ -5,11 +5,14 @@ from fastapi import FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from fastapi_responses import custom_openapi
 
-from config import DOCS, XRAY_SUBSCRIPTION_PATH
+from app.utils import leader
+from app.utils.compression import CompressionMiddleware
+from app.utils.serialization import FastJSONResponse
+from config import (CACHE_REDIS_URL, DOCS, RESPONSE_COMPRESSION, SQLALCHEMY_REPLICA_URLS,
+                    STANDALONE_WORKER, XRAY_SUBSCRIPTION_PATH)
 
 __version__ = "0.6.0"
 
@@ -19,7 +22,8 @@ app = FastAPI(
     description="Unified GUI Censorship Resistant Solution Powered by Xray",
     version=__version__,
     docs_url='/docs' if DOCS else None,
-    redoc_url='/redoc' if DOCS else None
+    redoc_url='/redoc' if DOCS else None,
+    default_response_class=FastJSONResponse
 )
 app.openapi = custom_openapi(app)
 scheduler = BackgroundScheduler({'apscheduler.job_defaults.max_instances': 20}, timezone='UTC')
@@ -31,6 +35,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
 
 
 from app import dashboard, telegram, views, jobs  # noqa
@@ -51,12 +57,32 @@ def on_startup():
     paths.append("/api/")
     if f"/{XRAY_SUBSCRIPTION_PATH}/" in paths:
         raise ValueError(f"you can't use /{XRAY_SUBSCRIPTION_PATH}/ as subscription path it reserved for {app.title}")
+    if leader.enabled() and not CACHE_REDIS_URL:
+        # the caches, their invalidations and the replicas routing would be per process
+        raise ValueError("CACHE_REDIS_URL is required with more than one UVICORN_WORKERS or STANDALONE_WORKER")
     scheduler.start()
 
+    if STANDALONE_WORKER:
+        logger.info("Jobs and Xray core run by `marzban-cli worker`, forwarding core and node operations to it")
+    else:
+        leader.campaign_until_elected(scheduler)
+
 
 @app.on_event("shutdown")
 def on_shutdown():
     scheduler.shutdown()
+    leader.resign()
+
+
+if SQLALCHEMY_REPLICA_URLS:
+    from app.db import replicas
+
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        # the next reads of an admin modifying something go to the primary
+        if request.method not in ("GET", "HEAD", "OPTIONS"):
+            replicas.mark_written(request.headers.get("Authorization"))
+        return await call_next(request)
 
 
 @app.exception_handler(RequestValidationError)
@@ -64,7 +90,15 @@ def validation_exception_handler(request: Request, exc: RequestValidationError):
     details = {}
     for error in exc.errors():
         details[error["loc"][-1]] = error.get("msg")
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content=jsonable_encoder({"detail": details}),
     )
+
+
+@app.exception_handler(leader.LeaderError)
+def leader_exception_handler(request: Request, exc: leader.LeaderError):
+    return FastJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+    )
@@ -1,12 +1,16 @@
+from fastapi import Request
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
+from . import replicas
 from .base import Base, SessionLocal, engine  # noqa
 
 
 class GetDB:  # Context Manager
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, read_only: bool = False):
+        # read only sessions are served by a replica when there's one close enough to the primary
+        replica = replicas.pick() if read_only else None
+        self.db = SessionLocal(bind=replica) if replica else SessionLocal()
 
     def __enter__(self):
         return self.db
@@ -23,12 +27,18 @@ def get_db():  # Dependency
         yield db
 
 
+def get_read_db(request: Request):  # Dependency of endpoints that don't write
+    with GetDB(read_only=not replicas.recently_written(request.headers.get("Authorization"))) as db:
+        yield db
+
+
 from .crud import (create_admin, create_notification_reminder,  # noqa
                    create_user, delete_notification_reminder, get_admin,
                    get_admins, get_jwt_secret_key, get_notification_reminder,
                    get_or_create_inbound, get_system_usage,
                    get_tls_certificate, get_user, get_user_by_id, get_users,
-                   get_users_count, remove_admin, remove_user, revoke_user_sub,
+                   get_users_count, get_users_count_by_status,
+                   remove_admin, remove_user, revoke_user_sub,
                    set_owner, update_admin, update_user, update_user_status,
                    update_user_sub, start_user_expire, get_admin_by_id,
                    get_admin_by_telegram_id)
@@ -41,6 +51,7 @@ __all__ = [
     "get_user_by_id",
     "get_users",
     "get_users_count",
+    "get_users_count_by_status",
     "create_user",
     "remove_user",
     "update_user",
@@ -66,6 +77,7 @@ __all__ = [
 
     "GetDB",
     "get_db",
+    "get_read_db",
 
     "User",
     "System",
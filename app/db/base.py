@@ -1,23 +1,28 @@
-from config import SQLALCHEMY_DATABASE_URL
+from config import SQLALCHEMY_DATABASE_URL, SQLALCHEMY_REPLICA_URLS
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith('sqlite')
 
-if IS_SQLITE:
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
+
+def make_engine(url: str):
+    if url.startswith('sqlite'):
+        return create_engine(
+            url,
+            connect_args={"check_same_thread": False}
+        )
+    return create_engine(
+        url,
         pool_size=10,
         max_overflow=30,
         pool_recycle=3600,
         pool_timeout=10
     )
 
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+replica_engines = [make_engine(url) for url in SQLALCHEMY_REPLICA_URLS]
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
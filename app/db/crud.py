@@ -1,15 +1,20 @@
-from datetime import datetime, timedelta
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from sqlalchemy import and_, delete, or_
-from sqlalchemy.orm import Query, Session, joinedload
+from sqlalchemy import (Integer, and_, bindparam, delete, func, or_, select,
+                        text, update)
+from sqlalchemy.orm import Query, Session, joinedload, selectinload
 from sqlalchemy.sql.functions import coalesce
 
+from app.db import replicas
 from app.db.models import (JWT, TLS, Admin, Node, NodeUsage, NodeUserUsage,
                            NotificationReminder, Proxy, ProxyHost,
                            ProxyInbound, ProxyTypes, System, User,
-                           UserTemplate, UserUsageResetLogs)
+                           UserTemplate, UserUsageResetLogs,
+                           WebhookNotification, excluded_inbounds_association)
 from app.models.admin import AdminCreate, AdminModify, AdminPartialModify
 from app.models.node import (NodeCreate, NodeModify, NodeStatus,
                              NodeUsageResponse)
@@ -18,9 +23,13 @@ from app.models.user import (ReminderType, UserCreate,
                              UserDataLimitResetStrategy, UserModify,
                              UserResponse, UserStatus, UserUsageResponse)
 from app.models.user_template import UserTemplateCreate, UserTemplateModify
+from app.subscription.cache import bump_version
+from app.subscription.cache import cache as subscription_cache
+from app.utils import users_count
 from app.utils.helpers import (calculate_expiration_days,
                                calculate_usage_percent)
 from app.utils.notification import Notification
+from app.utils.store import shared_cache
 from config import (NOTIFY_DAYS_LEFT, NOTIFY_REACHED_USAGE_PERCENT,
                     USERS_AUTODELETE_DAYS)
 
@@ -66,6 +75,7 @@ def add_host(db: Session, inbound_tag: str, host: ProxyHostModify):
     )
     db.commit()
     db.refresh(inbound)
+    bump_version("hosts")
     return inbound.hosts
 
 
@@ -92,11 +102,16 @@ def update_hosts(db: Session, inbound_tag: str, modified_hosts: List[ProxyHostMo
     ]
     db.commit()
     db.refresh(inbound)
+    bump_version("hosts")
     return inbound.hosts
 
 
 def get_user_queryset(db: Session) -> Query:
-    return db.query(User).options(joinedload(User.admin))
+    # everything a UserResponse needs, in a fixed number of queries however many users are loaded
+    return db.query(User).options(
+        joinedload(User.admin),
+        selectinload(User.proxies).selectinload(Proxy.excluded_inbounds),
+    )
 
 
 def get_user(db: Session, username: str):
@@ -107,6 +122,25 @@ def get_user_by_id(db: Session, user_id: int):
     return get_user_queryset(db).filter(User.id == user_id).first()
 
 
+def get_user_stamp(db: Session, username: str):
+    """
+    Only the columns a rendered subscription depends on (see
+    app.subscription.cache.user_stamp) and the ones needed to check its token.
+    """
+    return db.query(
+        User.id,
+        User.username,
+        User.status,
+        User.used_traffic,
+        User.data_limit,
+        User.expire,
+        User.on_hold_expire_duration,
+        User.edit_at,
+        User.sub_revoked_at,
+        User.created_at,
+    ).filter(User.username == username).first()
+
+
 UsersSortingOptions = Enum('UsersSortingOptions', {
     'username': User.username.asc(),
     'used_traffic': User.used_traffic.asc(),
@@ -121,6 +155,121 @@ UsersSortingOptions = Enum('UsersSortingOptions', {
 })
 
 
+# whether the database has the search index of the users_search_index migration
+_users_search_index: Optional[bool] = None
+
+
+def has_users_search_index(db: Session) -> bool:
+    global _users_search_index
+
+    if _users_search_index is None:
+        if db.bind.name == 'sqlite':
+            # the table is only kept up to date by its triggers, which batch_alter_table drops
+            query = ("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_search' "
+                     "AND (SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                     "AND name IN ('users_search_ai', 'users_search_ad', 'users_search_au')) = 3")
+        elif db.bind.name == 'mysql':
+            query = ("SELECT 1 FROM information_schema.statistics "
+                     "WHERE table_schema = DATABASE() AND table_name = 'users' AND index_name = 'ix_users_search'")
+        else:
+            query = None  # postgresql's trigram indexes serve ILIKE by themselves
+        _users_search_index = bool(query and db.execute(text(query)).first())
+
+    return _users_search_index
+
+
+def filter_users_search(db: Session, query: Query, search: str) -> Query:
+    """
+    Filters users whose username or note contain `search`, narrowed down
+    by the search index first when there is one (trigrams need 3 characters).
+    """
+    if len(search) >= 3 and has_users_search_index(db):
+        if db.bind.name == 'sqlite':
+            matches = text("SELECT rowid FROM users_search WHERE users_search MATCH :search") \
+                .bindparams(search='"%s"' % search.replace('"', '""')) \
+                .columns(rowid=Integer)
+            query = query.filter(User.id.in_(matches))
+        else:
+            query = query.filter(
+                text("MATCH (users.username, users.note) AGAINST (:search IN BOOLEAN MODE)")
+                .bindparams(search='"%s"' % search.replace('"', ' '))
+            )
+
+    return query.filter(or_(User.username.ilike(f"%{search}%"), User.note.ilike(f"%{search}%")))
+
+
+# columns used by cursor pagination, nullable ones are compared as 0
+USERS_CURSOR_COLUMNS = {
+    'username': User.username,
+    'used_traffic': User.used_traffic,
+    'data_limit': coalesce(User.data_limit, 0),
+    'expire': coalesce(User.expire, 0),
+    'created_at': User.created_at,
+}
+
+
+def get_users_cursor_sort(sort: Optional[List[UsersSortingOptions]] = None) -> Tuple[str, Any, bool]:
+    """
+    Returns the name, column and direction of the sort option a users cursor
+    follows, cursors support a single sort option (ordered by id if none).
+    """
+    if not sort:
+        return 'id', None, False
+    if len(sort) > 1:
+        raise ValueError('Cursor pagination supports a single sort option')
+
+    name = sort[0].name
+    return name, USERS_CURSOR_COLUMNS[name.lstrip('-')], name.startswith('-')
+
+
+def encode_users_cursor(dbuser: User, sort: Optional[List[UsersSortingOptions]] = None) -> str:
+    name, _, _ = get_users_cursor_sort(sort)
+    value = getattr(dbuser, name.lstrip('-')) if name != 'id' else None
+    if name.lstrip('-') in ('data_limit', 'expire'):
+        value = value or 0
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+
+    data = json.dumps([name, value, dbuser.id], separators=(',', ':'))
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_users_cursor(cursor: str, sort: Optional[List[UsersSortingOptions]] = None) -> Tuple[Any, int]:
+    name, _, _ = get_users_cursor_sort(sort)
+    try:
+        cursor_name, value, last_id = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if name.lstrip('-') == 'created_at':
+            value = datetime.fromisoformat(value)
+        last_id = int(last_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+    if cursor_name != name:
+        raise ValueError("Cursor doesn't match the sort option")
+
+    return value, last_id
+
+
+def estimate_users_count(db: Session) -> int:
+    """
+    Number of users from the table statistics where the database keeps them,
+    much cheaper than counting on big tables but only approximate.
+    """
+    count = None
+    if db.bind.name == 'postgresql':
+        count = db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'users'")).scalar()
+    elif db.bind.name == 'mysql':
+        count = db.execute(text(
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = 'users'"
+        )).scalar()
+
+    # never analyzed tables have no statistics
+    if count is None or count < 0:
+        count = db.query(func.count(User.id)).scalar()
+    return count
+
+
 def get_users(db: Session,
               offset: Optional[int] = None,
               limit: Optional[int] = None,
@@ -131,11 +280,18 @@ def get_users(db: Session,
               admin: Optional[Admin] = None,
               admins: Optional[List[str]] = None,
               reset_strategy: Optional[Union[UserDataLimitResetStrategy, list]] = None,
-              return_with_count: bool = False) -> Union[List[User], Tuple[List[User], int]]:
+              return_with_count: bool = False,
+              cursor: Optional[str] = None,
+              estimated_count: bool = False) -> Union[List[User], Tuple[List[User], int]]:
+    """
+    Pass a `cursor` (an empty one for the first page) to paginate by keys
+    instead of offset, see encode_users_cursor. `estimated_count` uses the
+    table statistics for the count when no filter is given.
+    """
     query = get_user_queryset(db)
 
     if search:
-        query = query.filter(or_(User.username.ilike(f"%{search}%"), User.note.ilike(f"%{search}%")))
+        query = filter_users_search(db, query, search)
 
     if usernames:
         query = query.filter(User.username.in_(usernames))
@@ -160,13 +316,35 @@ def get_users(db: Session,
 
     # count it before applying limit and offset
     if return_with_count:
-        count = query.count()
+        filtered = search or usernames or status or reset_strategy or admin or admins
+        if estimated_count and not filtered:
+            count = estimate_users_count(db)
+        else:
+            count = query.count()
+
+    if cursor is not None:
+        _, column, descending = get_users_cursor_sort(sort)
+        if cursor:
+            value, last_id = decode_users_cursor(cursor, sort)
+            if column is None:
+                query = query.filter(User.id < last_id if descending else User.id > last_id)
+            elif descending:
+                query = query.filter(or_(column < value, and_(column == value, User.id < last_id)))
+            else:
+                query = query.filter(or_(column > value, and_(column == value, User.id > last_id)))
 
-    if sort:
-        query = query.order_by(*(opt.value for opt in sort))
+        # id breaks ties so every user is returned exactly once
+        if column is not None:
+            query = query.order_by(column.desc() if descending else column.asc())
+        query = query.order_by(User.id.desc() if descending else User.id.asc())
+
+    else:
+        if sort:
+            query = query.order_by(*(opt.value for opt in sort))
+
+        if offset:
+            query = query.offset(offset)
 
-    if offset:
-        query = query.offset(offset)
     if limit:
         query = query.limit(limit)
 
@@ -215,6 +393,31 @@ def get_users_count(db: Session, status: UserStatus = None, admin: Admin = None)
     return query.count()
 
 
+def get_users_count_by_status(db: Session, admin: Admin = None) -> Dict[UserStatus, int]:
+    """
+    Users count of every status (all users, or an admin's) in one query,
+    or from the counters of app.utils.users_count if USERS_COUNT_CACHE_TTL is set.
+    """
+    if users_count.enabled():
+        counts = users_count.get(admin.id if admin else None, all_admins=not admin)
+        if counts is None:
+            users_count.load(
+                db.query(User.admin_id, User.status, func.count(User.id)).group_by(User.admin_id, User.status)
+            )
+            counts = users_count.get(admin.id if admin else None, all_admins=not admin)
+        if counts is not None:
+            return counts
+
+    query = db.query(User.status, func.count(User.id))
+    if admin:
+        query = query.filter(User.admin == admin)
+
+    counts = users_count.empty_counts()
+    for status, count in query.group_by(User.status):
+        counts[UserStatus(status)] = count
+    return counts
+
+
 def create_user(db: Session, user: UserCreate, admin: Admin = None):
     excluded_inbounds_tags = user.excluded_inbounds
     proxies = []
@@ -244,23 +447,52 @@ def create_user(db: Session, user: UserCreate, admin: Admin = None):
     db.add(dbuser)
     db.commit()
     db.refresh(dbuser)
+    users_count.add(dbuser.admin_id, dbuser.status)
     return dbuser
 
 
 def remove_user(db: Session, dbuser: User):
     db.delete(dbuser)
     db.commit()
+    subscription_cache.invalidate_user(dbuser.username)
+    replicas.mark_user_written(dbuser.username)
+    users_count.add(dbuser.admin_id, dbuser.status, -1)
     return dbuser
 
 
 def remove_users(db: Session, dbusers: List[User]):
+    """
+    Deletes users and their rows in other tables with a few set-based
+    statements. The users are detached, what's loaded of them stays usable.
+    """
+    user_ids = [dbuser.id for dbuser in dbusers]
     for dbuser in dbusers:
-        db.delete(dbuser)
+        db.expunge(dbuser)
+
+    # in chunks, to stay below the bound parameters limit of sqlite
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        proxy_ids = select(Proxy.id).where(Proxy.user_id.in_(chunk))
+        for stmt in (
+            delete(excluded_inbounds_association).where(excluded_inbounds_association.c.proxy_id.in_(proxy_ids)),
+            delete(Proxy).where(Proxy.user_id.in_(chunk)),
+            delete(NodeUserUsage).where(NodeUserUsage.user_id.in_(chunk)),
+            delete(NotificationReminder).where(NotificationReminder.user_id.in_(chunk)),
+            # reset logs are kept, like the ORM does when deleting a user
+            update(UserUsageResetLogs).where(UserUsageResetLogs.user_id.in_(chunk)).values(user_id=None),
+            delete(User).where(User.id.in_(chunk)),
+        ):
+            db.execute(stmt.execution_options(synchronize_session=False))
+
     db.commit()
-    return
+    for dbuser in dbusers:
+        subscription_cache.invalidate_user(dbuser.username)
+        replicas.mark_user_written(dbuser.username)
+        users_count.add(dbuser.admin_id, dbuser.status, -1)
 
 
 def update_user(db: Session, dbuser: User, modify: UserModify):
+    old_status = dbuser.status
     added_proxies: Dict[ProxyTypes, Proxy] = {}
     if modify.proxies:
         for proxy_type, settings in modify.proxies.items():
@@ -327,10 +559,14 @@ def update_user(db: Session, dbuser: User, modify: UserModify):
 
     db.commit()
     db.refresh(dbuser)
+    subscription_cache.invalidate_user(dbuser.username)
+    replicas.mark_user_written(dbuser.username)
+    users_count.move(dbuser.admin_id, old_status, dbuser.admin_id, dbuser.status)
     return dbuser
 
 
 def reset_user_data_usage(db: Session, dbuser: User):
+    old_status = dbuser.status
     usage_log = UserUsageResetLogs(
         user=dbuser,
         used_traffic_at_reset=dbuser.used_traffic,
@@ -345,6 +581,9 @@ def reset_user_data_usage(db: Session, dbuser: User):
 
     db.commit()
     db.refresh(dbuser)
+    subscription_cache.invalidate_user(dbuser.username)
+    replicas.mark_user_written(dbuser.username)
+    users_count.move(dbuser.admin_id, old_status, dbuser.admin_id, dbuser.status)
     return dbuser
 
 
@@ -359,6 +598,8 @@ def revoke_user_sub(db: Session, dbuser: User):
 
     db.commit()
     db.refresh(dbuser)
+    subscription_cache.invalidate_user(dbuser.username)
+    replicas.mark_user_written(dbuser.username)
     return dbuser
 
 
@@ -371,21 +612,105 @@ def update_user_sub(db: Session, dbuser: User, user_agent: str):
     return dbuser
 
 
-def reset_all_users_data_usage(db: Session, admin: Optional[Admin] = None):
-    query = get_user_queryset(db)
+def update_users_sub(db: Session, updates: List[dict]):
+    """
+    Bulk version of update_user_sub, each update is a dict of
+    `uid`, `sub_updated` and `sub_agent`.
+    """
+    if not updates:
+        return
 
+    for params in updates:
+        params["sub_agent"] = (params["sub_agent"] or "")[:512]
+
+    stmt = update(User) \
+        .where(User.id == bindparam('uid')) \
+        .values(sub_updated_at=bindparam('sub_updated'), sub_last_user_agent=bindparam('sub_agent'))
+    db.execute(stmt, updates)
+    db.commit()
+
+
+def reset_all_users_data_usage(db: Session, admin: Optional[Admin] = None) -> List[User]:
+    """
+    Resets the usage of all users (or an admin's users) with set-based statements.
+
+    Returns:
+        list[User]: Users that were limited and are active again, they have to
+            be added back to the cores.
+    """
+    user_ids = db.query(User.id)
     if admin:
-        query = query.filter(User.admin == admin)
+        user_ids = user_ids.filter(User.admin == admin)
 
-    for dbuser in query.all():
-        dbuser.used_traffic = 0
-        if dbuser.status not in [UserStatus.on_hold, UserStatus.expired, UserStatus.disabled]:
-            dbuser.status = UserStatus.active
-        dbuser.usage_logs.clear()
-        dbuser.node_usages.clear()
-        db.add(dbuser)
+    limited_ids = [user_id for (user_id,) in user_ids.filter(User.status == UserStatus.limited)]
 
+    users = update(User)
+    if admin:
+        users = users.where(User.admin_id == admin.id)
+
+    stmts = [
+        users.values(used_traffic=0),
+        users.where(User.status == UserStatus.limited).values(status=UserStatus.active),
+    ]
+    if admin:
+        user_ids = [user_id for (user_id,) in user_ids]
+        # in chunks, to stay below the bound parameters limit of sqlite
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            stmts += [
+                update(UserUsageResetLogs).where(UserUsageResetLogs.user_id.in_(chunk)).values(user_id=None),
+                delete(NodeUserUsage).where(NodeUserUsage.user_id.in_(chunk)),
+            ]
+    else:
+        stmts += [
+            update(UserUsageResetLogs).where(UserUsageResetLogs.user_id.isnot(None)).values(user_id=None),
+            delete(NodeUserUsage),
+        ]
+
+    for stmt in stmts:
+        db.execute(stmt.execution_options(synchronize_session=False))
     db.commit()
+    subscription_cache.invalidate_all()
+    users_count.invalidate()
+
+    reactivated = []
+    for i in range(0, len(limited_ids), 500):
+        reactivated += get_user_queryset(db).filter(User.id.in_(limited_ids[i:i + 500])).all()
+    return reactivated
+
+
+def get_expired_users(db: Session,
+                      expired_after: Optional[datetime] = None,
+                      expired_before: Optional[datetime] = None,
+                      admin: Optional[Admin] = None) -> List[User]:
+    """
+    Expired and limited users, only those whose expire date has passed
+    and lies within the given window if one is given.
+    """
+    query = get_user_queryset(db).filter(User.status.in_([UserStatus.expired, UserStatus.limited]))
+    if admin:
+        query = query.filter(User.admin == admin)
+
+    if expired_after or expired_before:
+        query = query.filter(User.expire != 0, User.expire <= datetime.utcnow().timestamp())
+        if expired_after:
+            query = query.filter(User.expire >= expired_after.timestamp())
+        if expired_before:
+            query = query.filter(User.expire <= expired_before.timestamp())
+
+    return query.all()
+
+
+def days_passed_since(db: Session, column, days):
+    """
+    SQL condition that `days` (an integer expression) days passed since the datetime `column`.
+    """
+    now = datetime.utcnow()
+    if db.bind.name == 'sqlite':
+        return func.julianday(column) + days <= func.julianday(now)
+    if db.bind.name == 'mysql':
+        return func.timestampadd(text('DAY'), days, column) <= now
+    return column + func.make_interval(0, 0, 0, days) <= now
 
 
 def autodelete_expired_users(db: Session,
@@ -408,19 +733,11 @@ def autodelete_expired_users(db: Session,
 
     auto_delete = coalesce(User.auto_delete_in_days, USERS_AUTODELETE_DAYS)
 
-    query = db.query(
-        User, auto_delete,  # Use global auto-delete days as fallback
-    ).filter(
+    expired_users = get_user_queryset(db).filter(
         auto_delete >= 0,  # Negative values prevent auto-deletion
         User.status.in_(target_status),
-    )
-
-    # TODO: Handle time filter in query itself (NOTE: Be careful with sqlite's strange datetime handling)
-    expired_users = [
-        user
-        for (user, auto_delete) in query
-        if user.last_status_change + timedelta(days=auto_delete) <= datetime.utcnow()
-    ]
+        days_passed_since(db, User.last_status_change, auto_delete),
+    ).all()
 
     if expired_users:
         remove_users(db, expired_users)
@@ -429,17 +746,23 @@ def autodelete_expired_users(db: Session,
 
 
 def update_user_status(db: Session, dbuser: User, status: UserStatus):
+    old_status = dbuser.status
     dbuser.status = status
     dbuser.last_status_change = datetime.utcnow()
     db.commit()
     db.refresh(dbuser)
+    subscription_cache.invalidate_user(dbuser.username)
+    replicas.mark_user_written(dbuser.username)
+    users_count.move(dbuser.admin_id, old_status, dbuser.admin_id, dbuser.status)
     return dbuser
 
 
 def set_owner(db: Session, dbuser: User, admin: Admin):
+    old_admin_id = dbuser.admin_id
     dbuser.admin = admin
     db.commit()
     db.refresh(dbuser)
+    users_count.move(old_admin_id, dbuser.status, dbuser.admin_id, dbuser.status)
     return dbuser
 
 
@@ -449,6 +772,8 @@ def start_user_expire(db: Session, dbuser: User):
     dbuser.expire = expire
     db.commit()
     db.refresh(dbuser)
+    subscription_cache.invalidate_user(dbuser.username)
+    replicas.mark_user_written(dbuser.username)
     return dbuser
 
 
@@ -495,6 +820,7 @@ def update_admin(db: Session, dbadmin: Admin, modified_admin: AdminModify):
 
     db.commit()
     db.refresh(dbadmin)
+    shared_cache.bump("admins")
     return dbadmin
 
 
@@ -511,12 +837,15 @@ def partial_update_admin(db: Session, dbadmin: Admin, modified_admin: AdminParti
 
     db.commit()
     db.refresh(dbadmin)
+    shared_cache.bump("admins")
     return dbadmin
 
 
 def remove_admin(db: Session, dbadmin: Admin):
     db.delete(dbadmin)
     db.commit()
+    shared_cache.bump("admins")
+    users_count.invalidate()
     return dbadmin
 
 
@@ -753,3 +1082,9 @@ def delete_notification_reminder(db: Session, dbreminder: NotificationReminder)
     db.delete(dbreminder)
     db.commit()
     return
+
+
+def create_webhook_notifications(db: Session, payload: str, webhooks: List[str]) -> None:
+    """Stores a notification to be sent to each of the webhooks"""
+    db.add_all([WebhookNotification(webhook=webhook, payload=payload) for webhook in webhooks])
+    db.commit()
@@ -0,0 +1,105 @@
+"""users search index
+
+Revision ID: b7c3d2e41f05
+Revises: 2313cdc30da3
+Create Date: 2024-08-02 14:21:37.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c3d2e41f05'
+down_revision = '2313cdc30da3'
+branch_labels = None
+depends_on = None
+
+
+# sqlite keeps the index in an FTS5 table of trigrams, filled by triggers.
+# batch_alter_table recreates the users table and drops the triggers with it,
+# so migrations doing that on users must run this one's upgrade again, crud
+# checks the triggers and falls back to LIKE without them.
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER users_search_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_search (rowid, username, note) VALUES (new.id, new.username, new.note);
+    END
+    """,
+    """
+    CREATE TRIGGER users_search_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_search (users_search, rowid, username, note)
+        VALUES ('delete', old.id, old.username, old.note);
+    END
+    """,
+    """
+    CREATE TRIGGER users_search_au AFTER UPDATE OF username, note ON users BEGIN
+        INSERT INTO users_search (users_search, rowid, username, note)
+        VALUES ('delete', old.id, old.username, old.note);
+        INSERT INTO users_search (rowid, username, note) VALUES (new.id, new.username, new.note);
+    END
+    """,
+]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    if bind.engine.name == 'sqlite':
+        # the trigram tokenizer needs sqlite 3.34
+        version = bind.execute(sa.text('SELECT sqlite_version()')).scalar()
+        if tuple(int(i) for i in version.split('.')) < (3, 34):
+            return
+
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5("
+            "username, note, content='users', content_rowid='id', tokenize='trigram')"
+        )
+        for name in ('users_search_ai', 'users_search_ad', 'users_search_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {name}')
+        for trigger in SQLITE_TRIGGERS:
+            op.execute(trigger)
+        op.execute("INSERT INTO users_search (users_search) VALUES ('rebuild')")
+
+    if bind.engine.name == 'mysql':
+        # the ngram parser isn't available on mariadb
+        if not bind.execute(sa.text(
+            "SELECT 1 FROM information_schema.plugins WHERE plugin_name = 'ngram' AND plugin_status = 'ACTIVE'"
+        )).first():
+            return
+
+        # the ngram parser drops every token containing a stopword, and the default
+        # list has single letters like "a" and "i", the index is built without them
+        op.execute('SET SESSION innodb_ft_enable_stopword = 0')
+        op.execute('CREATE FULLTEXT INDEX ix_users_search ON users (username, note) WITH PARSER ngram')
+        op.execute('SET SESSION innodb_ft_enable_stopword = DEFAULT')
+
+    if bind.engine.name == 'postgresql':
+        if not bind.execute(sa.text(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )).first():
+            return
+
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_users_note_trgm ON users USING gin (note gin_trgm_ops)')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+
+    if bind.engine.name == 'sqlite':
+        for name in ('users_search_ai', 'users_search_ad', 'users_search_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {name}')
+        op.execute('DROP TABLE IF EXISTS users_search')
+
+    if bind.engine.name == 'mysql':
+        if bind.execute(sa.text(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = 'users' AND index_name = 'ix_users_search'"
+        )).first():
+            op.drop_index('ix_users_search', table_name='users')
+
+    if bind.engine.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_users_username_trgm')
+        op.execute('DROP INDEX IF EXISTS ix_users_note_trgm')
@@ -0,0 +1,53 @@
+"""hot path indexes
+
+Revision ID: c4a1f07d9e62
+Revises: b7c3d2e41f05
+Create Date: 2024-08-05 11:42:09.502913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a1f07d9e62'
+down_revision = 'b7c3d2e41f05'
+branch_labels = None
+depends_on = None
+
+
+# node_usages(created_at) is already served by its (created_at, node_id) unique constraint
+INDEXES = [
+    ('ix_users_status_expire', 'users', ['status', 'expire']),
+    ('ix_users_admin_id_status', 'users', ['admin_id', 'status']),
+    ('ix_users_data_limit_reset_strategy_status', 'users', ['data_limit_reset_strategy', 'status']),
+    ('ix_node_user_usages_user_id_created_at', 'node_user_usages', ['user_id', 'created_at']),
+    ('ix_notification_reminders_user_id_type', 'notification_reminders', ['user_id', 'type']),
+    ('ix_user_usage_logs_user_id', 'user_usage_logs', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def has_other_index(bind, name: str, table: str, column: str) -> bool:
+    return bool(bind.execute(sa.text(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = :table AND column_name = :column "
+        "AND seq_in_index = 1 AND index_name != :name"
+    ), {"table": table, "column": column, "name": name}).first())
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+
+    for name, table, columns in reversed(INDEXES):
+        # mysql drops its own index of a foreign key once another index starts with
+        # the key's column, and refuses to drop that index while the key needs it,
+        # so the plain index it had is made again first (named like mysql names it)
+        if bind.engine.name == 'mysql' and columns[0] in ('admin_id', 'user_id') \
+                and not has_other_index(bind, name, table, columns[0]):
+            op.create_index(columns[0], table, [columns[0]])
+        op.drop_index(name, table_name=table)
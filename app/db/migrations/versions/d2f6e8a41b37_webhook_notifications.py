@@ -0,0 +1,37 @@
+"""webhook notifications
+
+Revision ID: d2f6e8a41b37
+Revises: c4a1f07d9e62
+Create Date: 2024-08-19 10:27:45.118306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6e8a41b37'
+down_revision = 'c4a1f07d9e62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('webhook_notifications',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('webhook', sa.String(length=512), nullable=False),
+                    sa.Column('payload', sa.Text(), nullable=False),
+                    sa.Column('tries', sa.Integer(), nullable=False),
+                    sa.Column('send_at', sa.DateTime(), nullable=False),
+                    sa.Column('dead', sa.Boolean(), server_default='0', nullable=False),
+                    sa.Column('error', sa.String(length=512), nullable=True),
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_webhook_notifications_webhook_dead_send_at', 'webhook_notifications',
+                    ['webhook', 'dead', 'send_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_webhook_notifications_webhook_dead_send_at', table_name='webhook_notifications')
+    op.drop_table('webhook_notifications')
@@ -2,10 +2,10 @@ import os
 from datetime import datetime
 
 from sqlalchemy import (JSON, BigInteger, Boolean, Column, DateTime, Enum,
-                        Float, ForeignKey, Integer, String, Table,
-                        UniqueConstraint, func)
+                        Float, ForeignKey, Index, Integer, String, Table,
+                        Text, UniqueConstraint, func)
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import column_property, relationship
 from sqlalchemy.sql.expression import text, select
 
 from app import xray
@@ -33,6 +33,14 @@ class Admin(Base):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # users of a status, expired users within an expire window
+        Index('ix_users_status_expire', 'status', 'expire'),
+        # users and their count per status of an admin
+        Index('ix_users_admin_id_status', 'admin_id', 'status'),
+        # users due for a periodic usage reset, most have no reset strategy
+        Index('ix_users_data_limit_reset_strategy_status', 'data_limit_reset_strategy', 'status'),
+    )
 
     id = Column(Integer, primary_key=True)
     username = Column(String(34, collation='NOCASE'), unique=True, index=True)
@@ -82,10 +90,7 @@ class User(Base):
 
     @property
     def lifetime_used_traffic(self):
-        return (
-            sum([log.used_traffic_at_reset for log in self.usage_logs])
-            + self.used_traffic
-        )
+        return self.reseted_usage_sum + self.used_traffic
 
     @property
     def last_traffic_reset_time(self):
@@ -100,15 +105,10 @@ class User(Base):
 
     @property
     def inbounds(self):
-        _ = {}
-        for proxy in self.proxies:
-            _[proxy.type] = []
-            excluded_tags = [i.tag for i in proxy.excluded_inbounds]
-            for inbound in xray.config.inbounds_by_protocol.get(proxy.type, []):
-                if inbound["tag"] not in excluded_tags:
-                    _[proxy.type].append(inbound["tag"])
-
-        return _
+        return {
+            proxy.type: xray.config.resolve_inbounds(proxy.type, (i.tag for i in proxy.excluded_inbounds))
+            for proxy in self.proxies
+        }
 
 
 excluded_inbounds_association = Table(
@@ -145,12 +145,22 @@ class UserUsageResetLogs(Base):
     __tablename__ = "user_usage_logs"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     user = relationship("User", back_populates="usage_logs")
     used_traffic_at_reset = Column(BigInteger, nullable=False)
     reset_at = Column(DateTime, default=datetime.utcnow)
 
 
+# the sum of reseted_usage computed by the database, loaded in the same query as
+# the users wherever they're loaded instead of loading every reset log of every user
+User.reseted_usage_sum = column_property(
+    select([func.coalesce(func.sum(UserUsageResetLogs.used_traffic_at_reset), 0)])
+    .where(UserUsageResetLogs.user_id == User.id)
+    .correlate_except(UserUsageResetLogs)
+    .scalar_subquery()
+)
+
+
 class Proxy(Base):
     __tablename__ = "proxies"
 
@@ -266,6 +276,8 @@ class NodeUserUsage(Base):
     __tablename__ = "node_user_usages"
     __table_args__ = (
         UniqueConstraint('created_at', 'user_id', 'node_id'),
+        # a user's usage over time, the unique constraint serves time ranges of all users
+        Index('ix_node_user_usages_user_id_created_at', 'user_id', 'created_at'),
     )
 
     id = Column(Integer, primary_key=True)
@@ -293,6 +305,9 @@ class NodeUsage(Base):
 
 class NotificationReminder(Base):
     __tablename__ = "notification_reminders"
+    __table_args__ = (
+        Index('ix_notification_reminders_user_id_type', 'user_id', 'type'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -300,3 +315,23 @@ class NotificationReminder(Base):
     type = Column(Enum(ReminderType), nullable=False)
     expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class WebhookNotification(Base):
+    """
+    A notification waiting to be delivered to one of WEBHOOK_ADDRESS,
+    kept as a dead letter once it runs out of retries.
+    """
+    __tablename__ = "webhook_notifications"
+    __table_args__ = (
+        Index('ix_webhook_notifications_webhook_dead_send_at', 'webhook', 'dead', 'send_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    webhook = Column(String(512), nullable=False)
+    payload = Column(Text, nullable=False)
+    tries = Column(Integer, nullable=False, default=0)
+    send_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    dead = Column(Boolean, nullable=False, default=False, server_default='0')
+    error = Column(String(512), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
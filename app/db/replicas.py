@@ -0,0 +1,125 @@
+"""
+Routing of read only sessions to the replicas of SQLALCHEMY_REPLICA_URLS.
+
+A replica is used while it's at most REPLICA_MAX_LAG seconds behind the
+primary, its lag is measured at most every LAG_CHECK_INTERVAL seconds and a
+replica that can't be measured (unreachable, or not replicating) isn't used.
+Clients that just modified something, and the subscriptions of users that were
+just modified, read the primary for a while, so they don't get the changes
+undone by a replica that hasn't caught up yet, e.g. a revoked link still working.
+"""
+import hashlib
+import logging
+import time
+from itertools import count
+from threading import Lock
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.db.base import replica_engines
+from app.utils.store import shared_cache
+from config import REPLICA_MAX_LAG
+
+logger = logging.getLogger('uvicorn.error')
+
+# seconds a measured lag is trusted
+LAG_CHECK_INTERVAL = 5
+# seconds a client reads the primary after a modification, until the replicas
+# are known to have it
+WRITES_WINDOW = REPLICA_MAX_LAG + LAG_CHECK_INTERVAL
+
+_lags: Dict[Engine, Optional[float]] = {engine: None for engine in replica_engines}
+_checked_at: Dict[Engine, float] = {engine: 0 for engine in replica_engines}
+_locks: Dict[Engine, Lock] = {engine: Lock() for engine in replica_engines}
+_turn = count()
+
+
+def measure_lag(engine: Engine) -> Optional[float]:
+    """
+    Seconds the replica is behind its primary, None if it isn't replicating.
+    """
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            # nothing left to replay while streaming from the primary means no lag, however old
+            # the last transaction is, a replica cut off from it is as old as its last transaction
+            # (its status needs the pg_read_all_stats role, it's taken as cut off without it)
+            return conn.execute(text(
+                "SELECT CASE WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') "
+                "AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )).scalar()
+
+        if engine.dialect.name == "mysql":
+            try:
+                status = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+            except Exception:  # before MySQL 8.0.22 and MariaDB 10.5.1
+                status = conn.execute(text("SHOW SLAVE STATUS")).mappings().first()
+            if status is None:
+                return None
+            return status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+
+    return 0  # sqlite, a copy of the database without replication
+
+
+def lag(engine: Engine) -> Optional[float]:
+    """
+    The last measured lag of the replica, measured again when it's outdated.
+    Threads don't wait for a measure in progress and take the previous one.
+    """
+    if time.monotonic() - _checked_at[engine] < LAG_CHECK_INTERVAL or not _locks[engine].acquire(blocking=False):
+        return _lags[engine]
+
+    try:
+        _lags[engine] = measure_lag(engine)
+    except Exception as exc:
+        logger.warning(f"Unable to measure the lag of replica {engine.url!r}: {exc}")
+        _lags[engine] = None
+    finally:
+        _checked_at[engine] = time.monotonic()
+        _locks[engine].release()
+    return _lags[engine]
+
+
+def pick() -> Optional[Engine]:
+    """
+    A replica close enough to the primary, in turns, None if there's none.
+    """
+    if not replica_engines:
+        return None
+
+    start = next(_turn)
+    for i in range(len(replica_engines)):
+        engine = replica_engines[(start + i) % len(replica_engines)]
+        engine_lag = lag(engine)
+        if engine_lag is not None and engine_lag <= REPLICA_MAX_LAG:
+            return engine
+
+
+def _client_key(client: str) -> str:
+    return hashlib.sha1(client.encode()).hexdigest()
+
+
+def mark_written(client: Optional[str]) -> None:
+    """
+    Sends the reads of `client` (e.g. its Authorization header) to the primary for WRITES_WINDOW seconds.
+    """
+    if replica_engines and client:
+        shared_cache.set("writes", _client_key(client), True, ttl=WRITES_WINDOW)
+
+
+def recently_written(client: Optional[str]) -> bool:
+    return bool(client) and shared_cache.get("writes", _client_key(client), False)
+
+
+def mark_user_written(username: str) -> None:
+    """
+    Sends the reads of the subscription of `username` to the primary for WRITES_WINDOW seconds.
+    """
+    if replica_engines:
+        shared_cache.set("writes", f"user:{username.lower()}", True, ttl=WRITES_WINDOW)
+
+
+def user_recently_written(username: str) -> bool:
+    return bool(replica_engines) and shared_cache.get("writes", f"user:{username.lower()}", False)
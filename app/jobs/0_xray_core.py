@@ -4,6 +4,7 @@ import traceback
 from app import app, logger, scheduler, xray
 from app.db import GetDB, crud
 from app.models.node import NodeStatus
+from app.utils import leader
 from xray_api import exc as xray_exc
 
 
@@ -33,7 +34,7 @@ def core_health_check():
             xray.operations.connect_node(node_id, config)
 
 
-@app.on_event("startup")
+@leader.on_elected
 def start_core():
     logger.info("Generating Xray core config")
 
@@ -0,0 +1,31 @@
+from app import app, logger, scheduler
+from app.db import GetDB, crud
+from app.utils import sub_updates
+from config import SUB_UPDATES_FLUSH_INTERVAL
+
+
+def record_sub_updates():
+    updates = sub_updates.pop_all()
+    if not updates:
+        return
+
+    try:
+        with GetDB() as db:
+            crud.update_users_sub(db, updates)
+    except Exception:
+        # written with the next flush instead, e.g. when the database is locked
+        sub_updates.requeue(updates)
+        raise
+
+
+@app.on_event("shutdown")
+def app_shutdown():
+    logger.info("Recording pending subscription updates")
+    try:
+        record_sub_updates()
+    except Exception:
+        pass
+
+
+scheduler.add_job(record_sub_updates, 'interval', seconds=SUB_UPDATES_FLUSH_INTERVAL,
+                  coalesce=True, max_instances=1)
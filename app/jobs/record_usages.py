@@ -10,6 +10,7 @@ from sqlalchemy import and_, bindparam, insert, select, sql, update
 from app import scheduler, xray
 from app.db import GetDB
 from app.db.models import NodeUsage, NodeUserUsage, System, User
+from app.utils import leader
 from config import DISABLE_RECORDING_NODE_USAGE
 from xray_api import XRay as XRayAPI
 from xray_api import exc as xray_exc
@@ -195,5 +196,5 @@ def record_node_usages():
         record_node_stats(params, node_id)
 
 
-scheduler.add_job(record_user_usages, 'interval', coalesce=True, seconds=30, max_instances=1)
-scheduler.add_job(record_node_usages, 'interval', coalesce=True, seconds=10, max_instances=1)
+scheduler.add_job(leader.only(record_user_usages), 'interval', coalesce=True, seconds=30, max_instances=1)
+scheduler.add_job(leader.only(record_node_usages), 'interval', coalesce=True, seconds=10, max_instances=1)
@@ -2,7 +2,7 @@ import logging
 from app import logger, scheduler
 from app.db import GetDB, crud
 from app.models.admin import Admin
-from app.utils import report
+from app.utils import leader, report
 from app.jobs.utils import SYSTEM_ADMIN
 from config import USER_AUTODELETE_INCLUDE_LIMITED_ACCOUNTS
 
@@ -16,4 +16,4 @@ def remove_expired_users():
             logger.log(logging.INFO, "Expired user %s deleted." % user.username)
 
 
-scheduler.add_job(remove_expired_users, 'interval', coalesce=True, hours=6, max_instances=1)
+scheduler.add_job(leader.only(remove_expired_users), 'interval', coalesce=True, hours=6, max_instances=1)
@@ -3,6 +3,7 @@ from datetime import datetime
 from app import logger, scheduler, xray
 from app.db import crud, GetDB, get_users
 from app.models.user import UserDataLimitResetStrategy, UserStatus
+from app.utils import leader
 
 reset_strategy_to_days = {
     UserDataLimitResetStrategy.day.value: 1,
@@ -40,4 +41,4 @@ def reset_user_data_usage():
             logger.info(f"User data usage reset for User \"{user.username}\"")
 
 
-scheduler.add_job(reset_user_data_usage, 'interval', coalesce=True, hours=1)
+scheduler.add_job(leader.only(reset_user_data_usage), 'interval', coalesce=True, hours=1)
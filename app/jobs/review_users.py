@@ -7,7 +7,7 @@ from app import logger, scheduler, xray
 from app.db import (GetDB, get_notification_reminder, get_users,
                     start_user_expire, update_user_status)
 from app.models.user import ReminderType, UserResponse, UserStatus
-from app.utils import report
+from app.utils import leader, report
 from app.utils.concurrency import GetBG
 from app.utils.helpers import (calculate_expiration_days,
                                calculate_usage_percent)
@@ -87,4 +87,4 @@ def review():
             logger.info(f"User \"{user.username}\" status changed to {status}")
 
 
-scheduler.add_job(review, 'interval', seconds=10, coalesce=True, max_instances=1)
+scheduler.add_job(leader.only(review), 'interval', seconds=10, coalesce=True, max_instances=1)
@@ -1,80 +1,108 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from datetime import timedelta as td
-from typing import Any, Dict, List
+from typing import List, Optional
 
-from fastapi.encoders import jsonable_encoder
 from requests import Session
+from sqlalchemy import delete, not_, or_, select, update
 
-from config import (WEBHOOK_SECRET, WEBHOOK_ADDRESS, NUMBER_OF_RECURRENT_NOTIFICATIONS, 
-                    RECURRENT_NOTIFICATIONS_TIMEOUT)
-from app import app, logger, scheduler
+from config import (WEBHOOK_SECRET, WEBHOOK_ADDRESS, WEBHOOK_BATCH_SIZE, WEBHOOK_TIMEOUT,
+                    NUMBER_OF_RECURRENT_NOTIFICATIONS, RECURRENT_NOTIFICATIONS_TIMEOUT)
+from app import logger, scheduler
 from app.db import GetDB
-from app.db.models import NotificationReminder
-from app.utils.notification import queue
+from app.db.models import NotificationReminder, WebhookNotification
+from app.utils import leader
+from app.utils.serialization import dumpb, loads
 
-session = Session()
+# days the notifications that ran out of retries are kept for inspection
+DEAD_NOTIFICATIONS_DAYS = 7
 
-headers = {"x-webhook-secret": WEBHOOK_SECRET} if WEBHOOK_SECRET else None
+headers = {"Content-Type": "application/json"}
+if WEBHOOK_SECRET:
+    headers["x-webhook-secret"] = WEBHOOK_SECRET
 
+# every webhook is delivered by its own thread with its own connections,
+# so one that hangs or fails doesn't hold the others back
+sessions = {webhook: Session() for webhook in WEBHOOK_ADDRESS}
+executor = ThreadPoolExecutor(max_workers=max(len(WEBHOOK_ADDRESS), 1), thread_name_prefix="webhook")
 
-def send(data: List[Dict[Any, Any]]) -> bool:
-    """Send the notification to the webhook address provided by WEBHOOK_ADDRESS
 
-    Args:
-        data (List[Dict[Any, Any]]): list of json encoded notifications
+def send_req(w_address: str, data: bytes, count: int) -> Optional[str]:
+    """Posts the notifications to a webhook, returns the error if it didn't respond ok"""
+    try:
+        logger.debug(f"Sending {count} webhook updates to {w_address}")
+        r = sessions[w_address].post(w_address, data=data, headers=headers, timeout=WEBHOOK_TIMEOUT)
+        if r.ok:
+            return
+        error = f"{r.status_code} {r.reason}"
+    except Exception as err:
+        error = str(err) or type(err).__name__
+    logger.error(f"Unable to send {count} notifications to {w_address}: {error}")
+    return error
+
+
+def due_notifications(webhook: str) -> list:
+    with GetDB() as db:
+        return db.execute(
+            select(WebhookNotification.id, WebhookNotification.payload, WebhookNotification.tries)
+            .where(WebhookNotification.webhook == webhook,
+                   not_(WebhookNotification.dead),
+                   WebhookNotification.send_at <= dt.utcnow())
+            .order_by(WebhookNotification.id)
+            .limit(WEBHOOK_BATCH_SIZE)
+        ).all()
+
+
+def retry_later(ids: List[int], error: str) -> None:
+    """
+    Schedules the notifications again after about RECURRENT_NOTIFICATIONS_TIMEOUT seconds,
+    spread so they don't all come back at once, and gives up on the ones out of retries.
+    """
+    send_at = dt.utcnow() + td(seconds=RECURRENT_NOTIFICATIONS_TIMEOUT * random.uniform(0.5, 1.5))
+    with GetDB() as db:
+        db.execute(
+            update(WebhookNotification)
+            .where(WebhookNotification.id.in_(ids))
+            # mysql sets the columns in order with their new values, dead goes before tries
+            .ordered_values((WebhookNotification.dead, WebhookNotification.tries >= NUMBER_OF_RECURRENT_NOTIFICATIONS),
+                            (WebhookNotification.tries, WebhookNotification.tries + 1),
+                            (WebhookNotification.send_at, send_at),
+                            (WebhookNotification.error, error[:512]))
+        )
+        db.commit()
 
-    Returns:
-        bool: returns True if an ok response received
+
+def deliver(webhook: str) -> int:
+    """
+    Sends the due notifications of a webhook in batches of WEBHOOK_BATCH_SIZE
+    until none is left or the webhook fails, returns how many were sent.
     """
+    sent = 0
+    while notifications := due_notifications(webhook):
+        ids = [n.id for n in notifications]
+        # the payloads are stored once, their tries change on every retry
+        body = dumpb([{**loads(n.payload), "tries": n.tries} for n in notifications])
 
-    result_list = []
-    for webhook in WEBHOOK_ADDRESS:
-        result = send_req(w_address=webhook, data=data)
-        result_list.append(result)
-    if True in result_list:
-        return True
-    else:
-        return False
+        error = send_req(w_address=webhook, data=body, count=len(notifications))
+        if error is not None:
+            retry_later(ids, error)
+            return sent
 
+        with GetDB() as db:
+            db.execute(delete(WebhookNotification).where(WebhookNotification.id.in_(ids)))
+            db.commit()
+        sent += len(notifications)
 
-def send_req(w_address:str, data):
-    try:
-        logger.debug(f"Sending {len(data)} webhook updates to {w_address}")
-        r = session.post(w_address, json=data, headers=headers)
-        if r.ok:
-            return True
-        logger.error(r)
-    except Exception as err:
-        logger.error(err)
-    return False
+        if len(notifications) < WEBHOOK_BATCH_SIZE:
+            return sent
+    return sent
 
 
 def send_notifications():
-    if not queue:
-        return
-
-    notifications_to_send = list()
-    try:
-        while (notification := queue.popleft()):
-            if (notification.tries > NUMBER_OF_RECURRENT_NOTIFICATIONS):
-                continue
-            if notification.send_at > dt.utcnow().timestamp():
-                queue.append(notification)  # add it to the queue again for the next check
-                continue
-            notifications_to_send.append(notification)
-    except IndexError:  # if the queue is empty
-        pass
-
-    if not notifications_to_send:
-        return
-    if not send([jsonable_encoder(notif) for notif in notifications_to_send]):
-        for notification in notifications_to_send:
-            if (notification.tries + 1) > NUMBER_OF_RECURRENT_NOTIFICATIONS:
-                continue
-            notification.tries += 1
-            notification.send_at = (  # schedule notification for n seconds later
-                dt.utcnow() + td(seconds=RECURRENT_NOTIFICATIONS_TIMEOUT)).timestamp()
-            queue.append(notification)
+    for webhook, result in zip(WEBHOOK_ADDRESS, executor.map(deliver, WEBHOOK_ADDRESS)):
+        if result:
+            logger.debug(f"Sent {result} notifications to {webhook}")
 
 
 def delete_expired_reminders() -> None:
@@ -83,12 +111,24 @@ def delete_expired_reminders() -> None:
         db.commit()
 
 
-if WEBHOOK_ADDRESS:
-    @app.on_event("shutdown")
-    def app_shutdown():
-        logger.info("Sending pending notifications before shutdown...")
-        send_notifications()
+def delete_dead_notifications() -> None:
+    """Deletes the old notifications that ran out of retries or whose webhook was removed"""
+    with GetDB() as db:
+        db.execute(
+            delete(WebhookNotification)
+            .where(or_(WebhookNotification.dead, WebhookNotification.webhook.not_in(WEBHOOK_ADDRESS)),
+                   WebhookNotification.created_at < dt.utcnow() - td(days=DEAD_NOTIFICATIONS_DAYS))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
 
+if WEBHOOK_ADDRESS:
+    # pending notifications are stored in the database, whichever process
+    # is the leader sends them, after a restart as well
     logger.info("Send webhook job started")
-    scheduler.add_job(send_notifications, "interval", seconds=30, replace_existing=True)
-    scheduler.add_job(delete_expired_reminders, "interval", hours=2, start_date=dt.utcnow() + td(minutes=1))
+    scheduler.add_job(leader.only(send_notifications), "interval", seconds=30,
+                      coalesce=True, max_instances=1, replace_existing=True)
+    scheduler.add_job(leader.only(delete_expired_reminders), "interval", hours=2, start_date=dt.utcnow() + td(minutes=1))
+    scheduler.add_job(leader.only(delete_dead_notifications), "interval", hours=2,
+                      start_date=dt.utcnow() + td(minutes=2))
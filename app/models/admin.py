@@ -1,3 +1,4 @@
+from hashlib import sha256
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
@@ -7,7 +8,8 @@ from pydantic import BaseModel, validator
 
 from app.db import Session, crud, get_db
 from app.utils.jwt import get_admin_payload
-from config import SUDOERS
+from app.utils.store import shared_cache
+from config import ADMIN_CACHE_TTL, SUDOERS
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/admin/token")  # Admin view url
@@ -29,6 +31,7 @@ class Admin(BaseModel):
 
     @classmethod
     def get_admin(cls, token: str, db: Session):
+        # the payload is cached as well and expires with the token
         payload = get_admin_payload(token)
         if not payload:
             return
@@ -36,6 +39,13 @@ class Admin(BaseModel):
         if payload['username'] in SUDOERS and payload['is_sudo'] is True:
             return cls(username=payload['username'], is_sudo=True)
 
+        # token -> Admin in the "admins" namespace, bumped by crud whenever an admin is modified or removed,
+        # keyed by the token's hash so tokens don't show up in redis
+        key = sha256(token.encode()).hexdigest()
+        cached = shared_cache.get("admins", key) if ADMIN_CACHE_TTL > 0 else None
+        if cached:
+            return cls(**cached)
+
         dbadmin = crud.get_admin(db, payload['username'])
         if not dbadmin:
             return
@@ -46,7 +56,10 @@ class Admin(BaseModel):
             if dbadmin.password_reset_at > payload.get("created_at"):
                 return
 
-        return cls.from_orm(dbadmin)
+        admin = cls.from_orm(dbadmin)
+        if ADMIN_CACHE_TTL > 0:
+            shared_cache.set("admins", key, admin.dict(), ttl=ADMIN_CACHE_TTL)
+        return admin
 
     @classmethod
     def get_current(cls,
@@ -128,14 +128,10 @@ class UserCreate(User):
 
     @property
     def excluded_inbounds(self):
-        excluded = {}
-        for proxy_type in self.proxies:
-            excluded[proxy_type] = []
-            for inbound in xray.config.inbounds_by_protocol.get(proxy_type, []):
-                if not inbound["tag"] in self.inbounds.get(proxy_type, []):
-                    excluded[proxy_type].append(inbound["tag"])
-
-        return excluded
+        return {
+            proxy_type: xray.config.resolve_inbounds(proxy_type, self.inbounds.get(proxy_type, []))
+            for proxy_type in self.proxies
+        }
 
     @validator("inbounds", pre=True, always=True)
     def validate_inbounds(cls, inbounds, values, **kwargs):
@@ -159,10 +155,7 @@ class UserCreate(User):
             #     raise ValueError(f"{proxy_type} inbounds cannot be empty")
 
             else:
-                inbounds[proxy_type] = [
-                    i["tag"]
-                    for i in xray.config.inbounds_by_protocol.get(proxy_type, [])
-                ]
+                inbounds[proxy_type] = xray.config.resolve_inbounds(proxy_type)
 
         return inbounds
 
@@ -211,14 +204,10 @@ class UserModify(User):
 
     @property
     def excluded_inbounds(self):
-        excluded = {}
-        for proxy_type in self.inbounds:
-            excluded[proxy_type] = []
-            for inbound in xray.config.inbounds_by_protocol.get(proxy_type, []):
-                if not inbound["tag"] in self.inbounds.get(proxy_type, []):
-                    excluded[proxy_type].append(inbound["tag"])
-
-        return excluded
+        return {
+            proxy_type: xray.config.resolve_inbounds(proxy_type, self.inbounds.get(proxy_type, []))
+            for proxy_type in self.inbounds
+        }
 
     @validator("inbounds", pre=True, always=True)
     def validate_inbounds(cls, inbounds, values, **kwargs):
@@ -256,7 +245,54 @@ class UserModify(User):
         return status
 
 
-class UserResponse(User):
+class UserSummary(User):
+    """
+    The user as internal callers need it, without admin, usage logs
+    or links, which makes it much cheaper to build from the database.
+    """
+    username: str
+    status: UserStatus
+    used_traffic: int
+    created_at: datetime
+    proxies: dict
+
+    class Config:
+        orm_mode = True
+
+    @validator("proxies", pre=True, always=True)
+    def validate_proxies(cls, v, values, **kwargs):
+        if isinstance(v, list):
+            v = {p.type: p.settings for p in v}
+        return super().validate_proxies(v, values, **kwargs)
+
+
+class LazyField:
+    """
+    A field computed on first access (or serialization) instead of on
+    validation, the model keeps None for it until then.
+    """
+
+    def __init__(self, name: str, compute):
+        self.name = name
+        self.compute = compute
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = instance.__dict__.get(self.name)
+        if value is None:
+            value = instance.__dict__[self.name] = self.compute(instance)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+
+LAZY_FIELDS = ("links", "subscription_url")
+
+
+class UserResponse(UserSummary):
     username: str
     status: UserStatus
     used_traffic: int
@@ -272,28 +308,29 @@ class UserResponse(User):
     class Config:
         orm_mode = True
 
-    @validator("links", pre=False, always=True)
-    def validate_links(cls, v, values, **kwargs):
-        if not v:
-            return generate_v2ray_links(
-                values.get("proxies", {}), values.get("inbounds", {}), extra_data=values, reverse=False,
-            )
-        return v
+    @validator("links", "subscription_url", pre=False, always=True)
+    def validate_lazy_fields(cls, v):
+        # generated on access, see LazyField
+        return v or None
 
-    @validator("subscription_url", pre=False, always=True)
-    def validate_subscription_url(cls, v, values, **kwargs):
-        if not v:
-            salt = secrets.token_hex(8)
-            url_prefix = (XRAY_SUBSCRIPTION_URL_PREFIX).replace('*', salt)
-            token = create_subscription_token(values["username"])
-            return f"{url_prefix}/{XRAY_SUBSCRIPTION_PATH}/{token}"
-        return v
+    def generate_links(self) -> List[str]:
+        return generate_v2ray_links(self.proxies, self.inbounds, extra_data=self.__dict__, reverse=False)
 
-    @validator("proxies", pre=True, always=True)
-    def validate_proxies(cls, v, values, **kwargs):
-        if isinstance(v, list):
-            v = {p.type: p.settings for p in v}
-        return super().validate_proxies(v, values, **kwargs)
+    def generate_subscription_url(self) -> str:
+        salt = secrets.token_hex(8)
+        url_prefix = (XRAY_SUBSCRIPTION_URL_PREFIX).replace('*', salt)
+        token = create_subscription_token(self.username)
+        return f"{url_prefix}/{XRAY_SUBSCRIPTION_PATH}/{token}"
+
+    def _iter(self, *args, **kwargs):
+        for key, value in super()._iter(*args, **kwargs):
+            if value is None and key in LAZY_FIELDS:
+                value = getattr(self, key)
+            yield key, value
+
+
+UserResponse.links = LazyField("links", UserResponse.generate_links)
+UserResponse.subscription_url = LazyField("subscription_url", UserResponse.generate_subscription_url)
 
 
 class SubscriptionUserResponse(UserResponse):
@@ -323,7 +360,8 @@ class SubscriptionUserResponse(UserResponse):
 
 class UsersResponse(BaseModel):
     users: List[UserResponse]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 
 class UserUsageResponse(BaseModel):
@@ -0,0 +1,241 @@
+import time
+from hashlib import sha1
+from typing import TYPE_CHECKING, Union
+
+from app.subscription.share import render_fingerprint
+from app.utils.store import LRUCache, shared_cache
+from config import (RANDOMIZE_SUBSCRIPTION_CONFIGS, SUB_CACHE_MAX_SIZE,
+                    SUB_CACHE_TTL, SUB_STAMP_CACHE_TTL)
+
+if TYPE_CHECKING:
+    from app.db.models import User
+
+
+# versions of shared_cache bumped whenever hosts or the xray config change,
+# the bodies cached in process memory are dropped then
+VERSIONED = ("hosts", "config")
+
+
+def user_stamp(dbuser: "User") -> tuple:
+    """
+    Fields of a user that end up in a rendered subscription, either as
+    proxy settings or through the format variables of remarks and paths.
+    """
+    return (
+        dbuser.id,
+        dbuser.status,
+        dbuser.used_traffic,
+        dbuser.data_limit,
+        dbuser.expire,
+        dbuser.on_hold_expire_duration,
+        dbuser.edit_at,
+        dbuser.sub_revoked_at,
+    )
+
+
+class MemoryBackend:
+    def __init__(self, max_size: int):
+        # username -> {entry key: (expires_at, body)}
+        self._users = LRUCache(max_size=max_size)
+
+    def get(self, username: str, key: str) -> Union[bytes, None]:
+        entries = self._users.get(username)
+        if not entries:
+            return
+
+        try:
+            expires_at, body = entries[key]
+        except KeyError:
+            return
+
+        if expires_at < time.time():
+            return
+
+        return body
+
+    def set(self, username: str, key: str, body: bytes, ttl: int):
+        now = time.time()
+        entries = {
+            k: v for k, v in (self._users.get(username) or {}).items()
+            if v[0] >= now
+        }
+        entries[key] = (now + ttl, body)
+        self._users.set(username, entries)
+
+    def delete(self, username: str):
+        self._users.delete(username)
+
+    def clear(self):
+        self._users.clear()
+
+
+class RedisBackend:
+    prefix = "marzban:sub:"
+
+    def __init__(self, redis):
+        self._redis = redis
+
+    def get(self, username: str, key: str) -> Union[bytes, None]:
+        value = self._redis.hget(self.prefix + username, key)
+        if not value:
+            return
+
+        expires_at, body = value.split(b"\n", 1)
+        if float(expires_at) < time.time():
+            return
+
+        return body
+
+    def set(self, username: str, key: str, body: bytes, ttl: int):
+        name = self.prefix + username
+        with self._redis.pipeline() as pipe:
+            pipe.hset(name, key, f"{time.time() + ttl}\n".encode() + body)
+            pipe.expire(name, ttl)
+            pipe.execute()
+
+    def delete(self, username: str):
+        self._redis.delete(self.prefix + username)
+
+    def clear(self):
+        for name in self._redis.scan_iter(match=self.prefix + "*", count=1000):
+            self._redis.delete(name)
+
+
+class SubscriptionCache:
+    def __init__(self, ttl: int, max_size: int, stamp_ttl: int = 0):
+        self.ttl = ttl
+        self.backend = None
+        if ttl > 0:
+            self.backend = RedisBackend(shared_cache.redis) if shared_cache.redis else MemoryBackend(max_size)
+
+        # username -> the row returned by crud.get_user_stamp, lets conditional
+        # requests be answered without loading the user
+        self.stamps = LRUCache(max_size=max_size, ttl=stamp_ttl) if stamp_ttl > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        # randomized configs must be shuffled on every request
+        return self.backend is not None and not RANDOMIZE_SUBSCRIPTION_CONFIGS
+
+    @staticmethod
+    def make_key(dbuser: "User", config_format: str, as_base64: bool, reverse: bool,
+                 encoding: str = None) -> Union[str, None]:
+        """
+        None if the body can't be cached, see `render_fingerprint`.
+        """
+        fingerprint = render_fingerprint()
+        if fingerprint is None:
+            return
+
+        return ":".join(str(i) for i in (
+            encoding or "identity",
+            config_format,
+            int(as_base64),
+            int(reverse),
+            fingerprint,
+            *user_stamp(dbuser),
+        ))
+
+    def get(self, dbuser: "User", config_format: str, as_base64: bool, reverse: bool,
+            encoding: str = None) -> Union[bytes, None]:
+        """
+        The cached body, compressed with `encoding` if given.
+        """
+        if not self.enabled:
+            return
+
+        key = self.make_key(dbuser, config_format, as_base64, reverse, encoding)
+        if key is None:
+            return
+        try:
+            return self.backend.get(dbuser.username.lower(), key)
+        except Exception:  # never fail a subscription because of the cache
+            return
+
+    def set(self, dbuser: "User", config_format: str, as_base64: bool, reverse: bool, body: bytes,
+            encoding: str = None):
+        if not self.enabled:
+            return
+
+        key = self.make_key(dbuser, config_format, as_base64, reverse, encoding)
+        if key is None:
+            return
+        try:
+            self.backend.set(dbuser.username.lower(), key, body, self.ttl)
+        except Exception:
+            pass
+
+    @staticmethod
+    def make_etag(dbuser: "User", config_format: str, as_base64: bool, reverse: bool) -> Union[str, None]:
+        """
+        A weak validator of the body rendered for these arguments, weak as the
+        same tag goes with every content encoding of the body. `dbuser` may
+        also be a row from crud.get_user_stamp. None if bodies differ between
+        requests.
+        """
+        if RANDOMIZE_SUBSCRIPTION_CONFIGS:
+            return
+
+        key = SubscriptionCache.make_key(dbuser, config_format, as_base64, reverse)
+        if key is None:
+            return
+        return 'W/"%s"' % sha1(key.encode()).hexdigest()
+
+    def get_stamp(self, username: str):
+        if self.stamps is not None:
+            return self.stamps.get(username.lower())
+
+    def set_stamp(self, username: str, stamp):
+        if self.stamps is not None:
+            self.stamps.set(username.lower(), stamp)
+
+    def invalidate_user(self, username: str):
+        if self.stamps is not None:
+            self.stamps.delete(username.lower())
+
+        if self.backend is None:
+            return
+
+        try:
+            self.backend.delete(username.lower())
+        except Exception:
+            pass
+
+    def invalidate_all(self, local: bool = False):
+        """
+        Drops every cached body, only the ones in process memory if `local`.
+        """
+        if self.stamps is not None:
+            self.stamps.clear()
+
+        if self.backend is None or (local and isinstance(self.backend, RedisBackend)):
+            return
+
+        try:
+            self.backend.clear()
+        except Exception:
+            pass
+
+
+cache = SubscriptionCache(SUB_CACHE_TTL, SUB_CACHE_MAX_SIZE, SUB_STAMP_CACHE_TTL)
+
+
+def bump_version(name: str):
+    """
+    Marks every cached body as stale after a change of hosts or config, in
+    every process. Bodies in redis are just left to expire, a digest of the
+    hosts and config is part of their keys.
+    """
+    shared_cache.bump(name)
+    cache.invalidate_all(local=True)
+
+
+for name in VERSIONED:
+    shared_cache.on_bump(name)(lambda: cache.invalidate_all(local=True))
+
+
+__all__ = [
+    "cache",
+    "bump_version",
+    "user_stamp",
+]
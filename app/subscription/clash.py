@@ -1,18 +1,112 @@
-import json
-from random import choice
+from random import choice, shuffle
 
 import yaml
 
 from app.subscription.funcs import get_grpc_gun
-from app.templates import render_template
+from app.templates import (copy_json, get_asset, get_json_template,
+                           is_volatile, render_template)
 from config import (
     CLASH_SUBSCRIPTION_TEMPLATE,
     GRPC_USER_AGENT_TEMPLATE,
     MUX_TEMPLATE,
+    RANDOMIZE_SUBSCRIPTION_CONFIGS,
     USER_AGENT_TEMPLATE
 )
 
 
+class YAMLDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    # proxies may be shared between several places of the template
+    def ignore_aliases(self, data):
+        return True
+
+
+class Slot:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class ClashTemplate:
+    """
+    The clash template parsed once, with slots where the proxies, their names
+    and the remarks list go.
+
+    The template is rendered with probe proxies and the places they show up in
+    are turned into slots. Templates which do anything else with the proxies
+    (filtering, formatting their fields into strings, ...) can't be expressed
+    this way and keep being rendered by jinja on every request, as do the
+    templates using `now()` or other globals that change between renders.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self._slotted = set()
+        self.structure = None
+        if is_volatile(template):
+            return
+
+        self.structure = self._compile(self._render_probe(1), self._probe_data(1))
+        if self.structure is None or self.fill(self._probe_data(3)) != self._render_probe(3):
+            self.structure = None
+            self._slotted.clear()
+
+    @staticmethod
+    def _probe_data(count: int) -> dict:
+        proxies = [{"name": f"__marzban_proxy_{i}__"} for i in range(count)]
+        return {
+            "proxies": proxies,
+            "proxy_names": [p["name"] for p in proxies],
+            "proxy_remarks": [f"__marzban_remark_{i}__" for i in range(count)],
+        }
+
+    def _render_probe(self, count: int):
+        data = self._probe_data(count)
+        return yaml.load(
+            render_template(
+                self.template,
+                {"conf": {"proxies": data["proxies"], "proxy-groups": [], "rules": []},
+                 "proxy_remarks": data["proxy_remarks"]}
+            ),
+            Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        )
+
+    def _compile(self, obj, data: dict):
+        for name, value in data.items():
+            if obj == value:
+                return Slot(name)
+
+        if isinstance(obj, dict):
+            compiled = {}
+            for key, val in obj.items():
+                if "__marzban_" in str(key):
+                    return
+                compiled[key] = self._compile(val, data)
+                if compiled[key] is None and val is not None:
+                    return
+        elif isinstance(obj, list):
+            compiled = [self._compile(val, data) for val in obj]
+            if any(c is None and v is not None for c, v in zip(compiled, obj)):
+                return
+        elif isinstance(obj, str) and "__marzban_" in obj:
+            return
+        else:
+            return obj
+
+        if any(isinstance(v, Slot) or id(v) in self._slotted
+               for v in (compiled.values() if isinstance(compiled, dict) else compiled)):
+            self._slotted.add(id(compiled))
+        return compiled
+
+    def fill(self, data: dict, obj=None):
+        obj = self.structure if obj is None else obj
+        if isinstance(obj, Slot):
+            return data[obj.name]
+        if id(obj) not in self._slotted:
+            return obj
+        if isinstance(obj, dict):
+            return {key: self.fill(data, val) for key, val in obj.items()}
+        return [self.fill(data, val) for val in obj]
+
+
 class ClashConfiguration(object):
     def __init__(self):
         self.data = {
@@ -22,17 +116,15 @@ class ClashConfiguration(object):
             'rules': []
         }
         self.proxy_remarks = []
-        self.mux_template = render_template(MUX_TEMPLATE)
-        temp_user_agent_data = render_template(USER_AGENT_TEMPLATE)
-        user_agent_data = json.loads(temp_user_agent_data)
+        self.mux_template = get_json_template(MUX_TEMPLATE)
+        user_agent_data = get_json_template(USER_AGENT_TEMPLATE)
 
         if 'list' in user_agent_data and isinstance(user_agent_data['list'], list):
             self.user_agent_list = user_agent_data['list']
         else:
             self.user_agent_list = []
 
-        temp_grpc_user_agent_data = render_template(GRPC_USER_AGENT_TEMPLATE)
-        grpc_user_agent_data = json.loads(temp_grpc_user_agent_data)
+        grpc_user_agent_data = get_json_template(GRPC_USER_AGENT_TEMPLATE)
 
         if 'list' in grpc_user_agent_data and isinstance(grpc_user_agent_data['list'], list):
             self.grpc_user_agent_data = grpc_user_agent_data['list']
@@ -42,17 +134,27 @@ class ClashConfiguration(object):
     def render(self, reverse=False):
         if reverse:
             self.data['proxies'].reverse()
-        return yaml.dump(
-            yaml.load(
+        if RANDOMIZE_SUBSCRIPTION_CONFIGS:
+            shuffle(self.data['proxies'])
+            self.proxy_remarks = [proxy['name'] for proxy in self.data['proxies']]
+
+        template = get_asset(CLASH_SUBSCRIPTION_TEMPLATE, ClashTemplate)
+        if template.structure is not None:
+            data = template.fill({
+                "proxies": self.data['proxies'],
+                "proxy_names": [proxy['name'] for proxy in self.data['proxies']],
+                "proxy_remarks": self.proxy_remarks,
+            })
+        else:
+            data = yaml.load(
                 render_template(
                     CLASH_SUBSCRIPTION_TEMPLATE,
                     {"conf": self.data, "proxy_remarks": self.proxy_remarks}
                 ),
-                Loader=yaml.SafeLoader
-            ),
-            sort_keys=False,
-            allow_unicode=True
-        )
+                Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+            )
+
+        return yaml.dump(data, Dumper=YAMLDumper, sort_keys=False, allow_unicode=True)
 
     def __str__(self) -> str:
         return self.render()
@@ -178,8 +280,7 @@ class ClashConfiguration(object):
                 net_opts['method'] = 'GET'
                 net_opts['headers'] = {"Host": host}
 
-        mux_json = json.loads(self.mux_template)
-        mux_config = mux_json["clash"]
+        mux_config = copy_json(self.mux_template["clash"])
 
         if mux_enable:
             net_opts['smux'] = mux_config
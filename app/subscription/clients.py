@@ -0,0 +1,167 @@
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+from app.utils.store import LRUCache
+from config import (
+    SUB_CLIENT_RULES,
+    USE_CUSTOM_JSON_DEFAULT,
+    USE_CUSTOM_JSON_FOR_STREISAND,
+    USE_CUSTOM_JSON_FOR_V2RAYN,
+    USE_CUSTOM_JSON_FOR_V2RAYNG
+)
+
+MEDIA_TYPES = {
+    "clash-meta": "text/yaml",
+    "clash": "text/yaml",
+    "sing-box": "application/json",
+    "outline": "application/json",
+    "v2ray-json": "application/json",
+    "v2ray": "text/plain",
+}
+
+
+class Decision(NamedTuple):
+    config_format: str
+    as_base64: bool
+    reverse: bool
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.config_format]
+
+
+DEFAULT = Decision("v2ray", True, False)
+
+
+# backreferences are numbered by the pattern alone, they'd point to the wrong group once
+# patterns are joined together, and named groups could clash between patterns
+GROUP_REFERENCES = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?P[<=]")
+
+
+def parse_version(version: str) -> Tuple[int, ...]:
+    return tuple(int(i) for i in version.split("."))
+
+
+class ClientRule:
+    """
+    A user agent pattern and the subscription it gets.
+
+    `pattern` is matched at the start of the user agent. If `min_version`
+    is set, the first group of the pattern is the client version, and older
+    versions (or a disabled rule) get `fallback` instead.
+    """
+
+    def __init__(self,
+                 pattern: str,
+                 config_format: str,
+                 as_base64: bool = False,
+                 reverse: bool = False,
+                 min_version: Optional[str] = None,
+                 enabled: bool = True,
+                 fallback: Decision = DEFAULT):
+        if config_format not in MEDIA_TYPES:
+            raise ValueError(f'Unknown subscription format "{config_format}" for client pattern "{pattern}"')
+
+        self.pattern = pattern.lstrip("^")
+        try:
+            self.regex = re.compile(self.pattern)
+            # as it's joined with the others, e.g. global flags like (?i) are only valid at the start
+            re.compile(f"(?:{self.pattern})")
+        except re.error as exc:
+            raise ValueError(f'Invalid client pattern "{pattern}": {exc}')
+        if GROUP_REFERENCES.search(self.pattern):
+            raise ValueError(f'Client pattern "{pattern}" can\'t use backreferences or named groups')
+        if min_version and self.regex.groups < 1:
+            raise ValueError(f'Client pattern "{pattern}" needs a group capturing the version for min_version')
+        self.decision = Decision(config_format, as_base64, reverse)
+        self.min_version = parse_version(min_version) if min_version else None
+        self.enabled = enabled
+        self.fallback = fallback
+
+    def resolve(self, user_agent: str) -> Decision:
+        if not self.enabled:
+            return self.fallback
+
+        if self.min_version is not None:
+            version = self.regex.match(user_agent).group(1)
+            try:
+                if parse_version(version) < self.min_version:
+                    return self.fallback
+            except (AttributeError, ValueError):  # an optional group or not a version
+                return self.fallback
+
+        return self.decision
+
+
+class ClientRegistry:
+    def __init__(self, rules: List[ClientRule] = (), cache_size: int = 1024):
+        self.rules: List[ClientRule] = []
+        self._regex = None
+        self._decisions = LRUCache(max_size=cache_size)
+        for rule in rules:
+            self.register(rule)
+
+    def register(self, rule: ClientRule, first: bool = False):
+        rules = [rule, *self.rules] if first else [*self.rules, rule]
+        # the rules only change once they're compiled, the group of each rule is its index
+        self._regex = self._compile(rules)
+        self.rules = rules
+        self._decisions.clear()
+
+    @staticmethod
+    def _compile(rules: List[ClientRule]) -> re.Pattern:
+        # one alternation, each rule in its own named group, so the first
+        # matching rule wins just like an if/elif chain
+        try:
+            return re.compile("^(?:%s)" % "|".join(
+                f"(?P<rule{i}>{rule.pattern})" for i, rule in enumerate(rules)
+            ))
+        except re.error as exc:
+            raise ValueError(f'Invalid client patterns: {exc}')
+
+    def match(self, user_agent: str) -> Decision:
+        decision = self._decisions.get(user_agent)
+        if decision is not None:
+            return decision
+
+        m = self._regex.match(user_agent)
+        if m:
+            rule = self.rules[int(m.lastgroup[4:])]
+            decision = rule.resolve(user_agent)
+        else:
+            decision = DEFAULT
+
+        self._decisions.set(user_agent, decision)
+        return decision
+
+
+clients = ClientRegistry([
+    ClientRule(r"^([Cc]lash-verge|[Cc]lash[-\.]?[Mm]eta|[Ff][Ll][Cc]lash|[Mm]ihomo)", "clash-meta"),
+    ClientRule(r"^([Cc]lash|[Ss]tash)", "clash"),
+    ClientRule(r"^(SFA|SFI|SFM|SFT|[Kk]aring|[Hh]iddify[Nn]ext)", "sing-box"),
+    ClientRule(r"^(SS|SSR|SSD|SSS|Outline|Shadowsocks|SSconf)", "outline"),
+    ClientRule(r"^v2rayN/(\d+\.\d+)", "v2ray-json", min_version="6.40",
+               enabled=USE_CUSTOM_JSON_DEFAULT or USE_CUSTOM_JSON_FOR_V2RAYN),
+    ClientRule(r"^v2rayNG/(\d+\.\d+\.\d+)", "v2ray-json", reverse=True, min_version="1.8.18",
+               enabled=USE_CUSTOM_JSON_DEFAULT or USE_CUSTOM_JSON_FOR_V2RAYNG),
+    ClientRule(r"^[Ss]treisand", "v2ray-json",
+               enabled=USE_CUSTOM_JSON_DEFAULT or USE_CUSTOM_JSON_FOR_STREISAND),
+])
+
+for rule in reversed(SUB_CLIENT_RULES):
+    clients.register(ClientRule(
+        pattern=rule["pattern"],
+        config_format=rule["format"],
+        as_base64=rule.get("as_base64", False),
+        reverse=rule.get("reverse", False),
+        min_version=rule.get("min_version"),
+    ), first=True)
+
+
+__all__ = [
+    "clients",
+    "ClientRule",
+    "ClientRegistry",
+    "Decision",
+    "MEDIA_TYPES",
+]
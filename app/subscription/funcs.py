@@ -1,3 +1,9 @@
+import json
+
+from app.utils.serialization import dumps
+from config import SUB_COMPACT_JSON
+
+
 def get_grpc_gun(path: str) -> str:
     if not path.startswith("/"):
         return path
@@ -17,4 +23,15 @@ def get_grpc_multi(path: str) -> str:
     servicename = path.rsplit("/", 1)[0]
     streamname = path.rsplit("/", 1)[1].split("|")[1]
 
-    return "%s%s%s" % (servicename, "/", streamname)
\ No newline at end of file
+    return "%s%s%s" % (servicename, "/", streamname)
+
+
+def dump_json(config) -> str:
+    """
+    Serializes a json subscription, pretty-printed unless SUB_COMPACT_JSON is set.
+    Compact bodies go through the fast serializer, pretty-printed ones through the
+    json module to stay byte for byte as they were (4 spaces, ascii only).
+    """
+    if SUB_COMPACT_JSON:
+        return dumps(config)
+    return json.dumps(config, indent=4)
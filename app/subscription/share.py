@@ -1,26 +1,37 @@
 import base64
+import json
 import random
 import secrets
-import yaml
-import json
 from datetime import datetime as dt
 from datetime import timedelta
-from typing import TYPE_CHECKING, List, Literal, Union
+from string import Formatter
+from typing import TYPE_CHECKING, List, Literal, Tuple, Union
 from collections import defaultdict
+from hashlib import sha1
 
 from jdatetime import date as jd
 
 from app import xray
+from app.models.proxy import ProxyTypes
+from app.subscription.funcs import dump_json
+from app.templates import env, get_asset, is_volatile
+from app.utils.serialization import loads
+from app.utils.store import shared_cache
 from app.utils.system import get_public_ip, get_public_ipv6, readable_size
 
 from . import *
 
 if TYPE_CHECKING:
-    from app.models.user import UserResponse, UserStatus
+    from app.models.user import UserStatus, UserSummary
 
-from config import (ACTIVE_STATUS_TEXT, DISABLED_STATUS_TEXT,
-                    EXPIRED_STATUS_TEXT, LIMITED_STATUS_TEXT,
-                    ONHOLD_STATUS_TEXT, RANDOMIZE_SUBSCRIPTION_CONFIGS)
+import config as panel_config
+from config import (ACTIVE_STATUS_TEXT, CLASH_SUBSCRIPTION_TEMPLATE,
+                    DISABLED_STATUS_TEXT, EXPIRED_STATUS_TEXT,
+                    GRPC_USER_AGENT_TEMPLATE, LIMITED_STATUS_TEXT,
+                    MUX_TEMPLATE, ONHOLD_STATUS_TEXT,
+                    RANDOMIZE_SUBSCRIPTION_CONFIGS,
+                    SINGBOX_SUBSCRIPTION_TEMPLATE, USER_AGENT_TEMPLATE,
+                    V2RAY_SUBSCRIPTION_TEMPLATE)
 
 SERVER_IP = get_public_ip()
 SERVER_IPV6 = get_public_ipv6()
@@ -104,17 +115,8 @@ def randomize_sub_config(
         random.shuffle(config)
         config = "\n".join(config)
 
-    elif config_format in ("clash-meta", "clash"):
-        config = yaml.safe_load(config)
-        random.shuffle(config['proxies'])
-        for group in config['proxy-groups']:
-            if group['name'] == '♻️ Automatic':
-                group['proxies'] = [proxy['name']
-                                    for proxy in config['proxies']]
-        config = yaml.dump(config, allow_unicode=True, sort_keys=False)
-
     elif config_format == "sing-box":
-        config = json.loads(config)
+        config = loads(config)
         outbounds = config['outbounds']
         main_outbounds = [ob for ob in outbounds if ob['type']
                           in {'selector', 'urltest'}]
@@ -128,7 +130,7 @@ def randomize_sub_config(
         config['outbounds'] = main_outbounds + other_outbounds + \
             [ob for ob in outbounds if ob['type']
                 in {'direct', 'block', 'dns'}]
-        config = json.dumps(config, indent=4)
+        config = dump_json(config)
 
     elif config_format == "v2ray-json":
         random.shuffle(config)
@@ -137,7 +139,7 @@ def randomize_sub_config(
 
 
 def generate_subscription(
-    user: "UserResponse",
+    user: "UserSummary",
     config_format: Literal["v2ray", "clash-meta", "clash", "sing-box", "outline", "v2ray-json"],
     as_base64: bool,
     reverse: bool,
@@ -271,6 +273,155 @@ def setup_format_variables(extra_data: dict) -> dict:
     return format_variables
 
 
+def compile_format(template: str, static_variables: dict) -> Tuple[str, bool]:
+    """
+    Fills the fields of a format string that are known ahead of time.
+
+    Returns the partially formatted string and whether it still has fields
+    to be filled by `str.format_map`.
+    """
+    formatter = Formatter()
+    try:
+        parsed = list(formatter.parse(template))
+    except ValueError:
+        # malformed templates keep failing the way they used to, on render
+        return template, True
+
+    dynamic = False
+    parts = []
+    for literal, field, spec, conversion in parsed:
+        parts.append(literal)
+        if field is None:
+            continue
+        # only plain fields are filled here, conversions, format specs and attribute or
+        # index lookups are left to `str.format_map` so they behave (and fail) as before
+        if field in static_variables and not spec and not conversion:
+            parts.append(str(static_variables[field]))
+            continue
+        dynamic = True
+        parts.append((field, spec, conversion))
+
+    if not dynamic:
+        return "".join(parts), False
+
+    def escape(text: str) -> str:
+        return text.replace("{", "{{").replace("}", "}}")
+
+    text = ""
+    for part in parts:
+        if isinstance(part, str):
+            text += escape(part)
+            continue
+        field, spec, conversion = part
+        text += "{" + field + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}"
+
+    return text, True
+
+
+def fill(template: Tuple[str, bool], format_variables: dict) -> str:
+    text, dynamic = template
+    return text.format_map(format_variables) if dynamic else text
+
+
+def compile_hosts() -> list:
+    """
+    Turns every (inbound, host) pair into a template where only the user's
+    format variables and the random parts (sni, host and address salts)
+    are left to be filled per subscription.
+    """
+    compiled = []
+    for tag, inbound in xray.config.inbounds_by_tag.items():
+        try:
+            protocol = ProxyTypes(inbound["protocol"])
+        except ValueError:
+            continue
+
+        static_variables = {"PROTOCOL": protocol.name, "TRANSPORT": inbound["network"]}
+        hosts = []
+        for host in xray.hosts.get(tag, []):
+            path = host["path"] if host["path"] is not None else inbound.get("path", "")
+            host_inbound = inbound.copy()
+            host_inbound.update(
+                {
+                    "port": host["port"] or inbound["port"],
+                    "tls": inbound["tls"] if host["tls"] is None else host["tls"],
+                    "alpn": host["alpn"] if host["alpn"] else None,
+                    "fp": host["fingerprint"] or inbound.get("fp", ""),
+                    "ais": host["allowinsecure"]
+                    or inbound.get("allowinsecure", ""),
+                    "mux_enable": host["mux_enable"],
+                    "fragment_setting": host["fragment_setting"],
+                    "random_user_agent": host["random_user_agent"],
+                }
+            )
+            hosts.append({
+                "remark": compile_format(host["remark"], static_variables),
+                "address": compile_format(host["address"], static_variables),
+                "salted_address": "*" in host["address"],
+                "path": compile_format(path, static_variables),
+                "sni": host["sni"] or inbound["sni"],
+                "host": host["host"] or inbound["host"],
+                "inbound": host_inbound,
+            })
+
+        compiled.append((protocol, tag, static_variables, hosts))
+
+    return compiled
+
+
+_compiled_hosts = {"key": None, "hosts": [], "digest": b""}
+
+
+def get_compiled_hosts() -> list:
+    # taken before compiling, hosts loaded meanwhile get compiled on the next call
+    key = (xray.hosts_generation, shared_cache.version("config"), id(xray.config))
+    if _compiled_hosts["key"] != key:
+        hosts = compile_hosts()
+        _compiled_hosts["digest"] = sha1(json.dumps(hosts, sort_keys=True, default=str).encode()).digest()
+        _compiled_hosts["hosts"] = hosts
+        _compiled_hosts["key"] = key
+    return _compiled_hosts["hosts"]
+
+
+SUBSCRIPTION_TEMPLATES = (
+    CLASH_SUBSCRIPTION_TEMPLATE,
+    SINGBOX_SUBSCRIPTION_TEMPLATE,
+    V2RAY_SUBSCRIPTION_TEMPLATE,
+    MUX_TEMPLATE,
+    USER_AGENT_TEMPLATE,
+    GRPC_USER_AGENT_TEMPLATE,
+)
+
+# any setting may end up in a subscription (status texts, url prefix, ...),
+# they and the server's addresses only change with a restart
+_settings_digest = sha1(repr((
+    sorted((name, value) for name, value in vars(panel_config).items() if name.isupper()),
+    SERVER_IP,
+    SERVER_IPV6,
+)).encode()).digest()
+
+
+def _template_digest(template: str) -> bytes:
+    return sha1(env.loader.get_source(env, template)[0].encode()).digest()
+
+
+def render_fingerprint() -> Union[str, None]:
+    """
+    A digest of what rendered subscriptions depend on besides the user: the
+    hosts and inbounds, the templates and the settings. It only changes with
+    their content, not with restarts. None if a template uses `now()` or the
+    like, so bodies differ between renders.
+    """
+    digest = sha1(_settings_digest)
+    get_compiled_hosts()
+    digest.update(_compiled_hosts["digest"])
+    for template in SUBSCRIPTION_TEMPLATES:
+        if is_volatile(template):
+            return
+        digest.update(get_asset(template, _template_digest))
+    return digest.hexdigest()
+
+
 def process_inbounds_and_tags(
     inbounds: dict,
     proxies: dict,
@@ -279,71 +430,54 @@ def process_inbounds_and_tags(
     reverse=False,
 ) -> Union[List, str]:
 
-    _inbounds = []
+    settings_by_protocol = {}
     for protocol, tags in inbounds.items():
-        for tag in tags:
-            _inbounds.append((protocol, [tag]))
-    index_dict = {proxy: index for index, proxy in enumerate(
-        xray.config.inbounds_by_tag.keys())}
-    inbounds = sorted(
-        _inbounds, key=lambda x: index_dict.get(x[1][0], float('inf')))
-
-    for protocol, tags in inbounds:
         settings = proxies.get(protocol)
-        if not settings:
-            continue
+        if settings and tags:
+            settings_by_protocol[protocol] = (set(tags), settings.dict(no_obj=True))
 
-        format_variables.update({"PROTOCOL": protocol.name})
-        for tag in tags:
-            inbound = xray.config.inbounds_by_tag.get(tag)
-            if not inbound:
-                continue
+    for protocol, tag, static_variables, hosts in get_compiled_hosts():
+        try:
+            tags, settings = settings_by_protocol[protocol]
+        except KeyError:
+            continue
+        if tag not in tags:
+            continue
 
-            format_variables.update({"TRANSPORT": inbound["network"]})
-            host_inbound = inbound.copy()
-            for host in xray.hosts.get(tag, []):
-                sni = ""
-                sni_list = host["sni"] or inbound["sni"]
-                if sni_list:
-                    salt = secrets.token_hex(8)
-                    sni = random.choice(sni_list).replace("*", salt)
-
-                req_host = ""
-                req_host_list = host["host"] or inbound["host"]
-                if req_host_list:
-                    salt = secrets.token_hex(8)
-                    req_host = random.choice(req_host_list).replace("*", salt)
-                if host['address']:
-                    salt = secrets.token_hex(8)
-                    address = host['address'].replace('*', salt)
-                if host["path"] is not None:
-                    path = host["path"].format_map(format_variables)
-                else:
-                    path = inbound.get("path", "").format_map(format_variables)
-
-                host_inbound.update(
-                    {
-                        "port": host["port"] or inbound["port"],
-                        "sni": sni,
-                        "host": req_host,
-                        "tls": inbound["tls"] if host["tls"] is None else host["tls"],
-                        "alpn": host["alpn"] if host["alpn"] else None,
-                        "path": path,
-                        "fp": host["fingerprint"] or inbound.get("fp", ""),
-                        "ais": host["allowinsecure"]
-                        or inbound.get("allowinsecure", ""),
-                        "mux_enable": host["mux_enable"],
-                        "fragment_setting": host["fragment_setting"],
-                        "random_user_agent": host["random_user_agent"],
-                    }
-                )
-
-                conf.add(
-                    remark=host["remark"].format_map(format_variables),
-                    address=address.format_map(format_variables),
-                    inbound=host_inbound,
-                    settings=settings.dict(no_obj=True),
-                )
+        # for the fields left to be filled per subscription
+        format_variables.update(static_variables)
+
+        for host in hosts:
+            sni = ""
+            if host["sni"]:
+                salt = secrets.token_hex(8)
+                sni = random.choice(host["sni"]).replace("*", salt)
+
+            req_host = ""
+            if host["host"]:
+                salt = secrets.token_hex(8)
+                req_host = random.choice(host["host"]).replace("*", salt)
+
+            address_text, address_dynamic = host["address"]
+            if host["salted_address"]:
+                salt = secrets.token_hex(8)
+                address_text = address_text.replace("*", salt)
+
+            host_inbound = host["inbound"].copy()
+            host_inbound.update(
+                {
+                    "sni": sni,
+                    "host": req_host,
+                    "path": fill(host["path"], format_variables),
+                }
+            )
+
+            conf.add(
+                remark=fill(host["remark"], format_variables),
+                address=fill((address_text, address_dynamic), format_variables),
+                inbound=host_inbound,
+                settings=settings,
+            )
 
     return conf.render(reverse=reverse)
 
@@ -1,7 +1,6 @@
-import json
 from random import choice
-from app.templates import render_template
-from app.subscription.funcs import get_grpc_gun
+from app.templates import copy_json, get_json_template
+from app.subscription.funcs import dump_json, get_grpc_gun
 
 from config import (
     SINGBOX_SUBSCRIPTION_TEMPLATE,
@@ -15,19 +14,16 @@ class SingBoxConfiguration(str):
 
     def __init__(self):
         self.proxy_remarks = []
-        template = render_template(SINGBOX_SUBSCRIPTION_TEMPLATE)
-        self.config = json.loads(template)
-        self.mux_template = render_template(MUX_TEMPLATE)
-        temp_user_agent_data = render_template(USER_AGENT_TEMPLATE)
-        user_agent_data = json.loads(temp_user_agent_data)
+        self.config = copy_json(get_json_template(SINGBOX_SUBSCRIPTION_TEMPLATE))
+        self.mux_template = get_json_template(MUX_TEMPLATE)
+        user_agent_data = get_json_template(USER_AGENT_TEMPLATE)
 
         if 'list' in user_agent_data and isinstance(user_agent_data['list'], list):
             self.user_agent_list = user_agent_data['list']
         else:
             self.user_agent_list = []
 
-        temp_grpc_user_agent_data = render_template(GRPC_USER_AGENT_TEMPLATE)
-        grpc_user_agent_data = json.loads(temp_grpc_user_agent_data)
+        grpc_user_agent_data = get_json_template(GRPC_USER_AGENT_TEMPLATE)
 
         if 'list' in grpc_user_agent_data and isinstance(grpc_user_agent_data['list'], list):
             self.grpc_user_agent_data = grpc_user_agent_data['list']
@@ -65,7 +61,7 @@ class SingBoxConfiguration(str):
 
         if reverse:
             self.config["outbounds"].reverse()
-        return json.dumps(self.config, indent=4)
+        return dump_json(self.config)
 
     @staticmethod
     def tls_config(sni=None, fp=None, tls=None, pbk=None,
@@ -238,8 +234,7 @@ class SingBoxConfiguration(str):
                                             pbk=pbk, sid=sid, alpn=alpn,
                                             ais=ais)
 
-        mux_json = json.loads(self.mux_template)
-        mux_config = mux_json["sing-box"]
+        mux_config = copy_json(self.mux_template["sing-box"])
 
         config['multiplex'] = mux_config
         if config['multiplex']["enabled"]:
@@ -6,8 +6,8 @@ from typing import Union
 from urllib.parse import quote
 from uuid import UUID
 
-from app.subscription.funcs import get_grpc_gun, get_grpc_multi
-from app.templates import render_template
+from app.subscription.funcs import dump_json, get_grpc_gun, get_grpc_multi
+from app.templates import copy_json, get_json_template
 from config import (
     MUX_TEMPLATE,
     USER_AGENT_TEMPLATE,
@@ -394,18 +394,16 @@ class V2rayJsonConfig(str):
 
     def __init__(self):
         self.config = []
-        self.template = render_template(V2RAY_SUBSCRIPTION_TEMPLATE)
-        self.mux_template = render_template(MUX_TEMPLATE)
-        temp_user_agent_data = render_template(USER_AGENT_TEMPLATE)
-        user_agent_data = json.loads(temp_user_agent_data)
+        self.template = get_json_template(V2RAY_SUBSCRIPTION_TEMPLATE)
+        self.mux_template = get_json_template(MUX_TEMPLATE)
+        user_agent_data = get_json_template(USER_AGENT_TEMPLATE)
 
         if 'list' in user_agent_data and isinstance(user_agent_data['list'], list):
             self.user_agent_list = user_agent_data['list']
         else:
             self.user_agent_list = []
 
-        temp_grpc_user_agent_data = render_template(GRPC_USER_AGENT_TEMPLATE)
-        grpc_user_agent_data = json.loads(temp_grpc_user_agent_data)
+        grpc_user_agent_data = get_json_template(GRPC_USER_AGENT_TEMPLATE)
 
         if 'list' in grpc_user_agent_data and isinstance(grpc_user_agent_data['list'], list):
             self.grpc_user_agent_data = grpc_user_agent_data['list']
@@ -413,7 +411,7 @@ class V2rayJsonConfig(str):
             self.grpc_user_agent_data = []
 
     def add_config(self, remarks, outbounds):
-        json_template = json.loads(self.template)
+        json_template = copy_json(self.template)
         json_template["remarks"] = remarks
         json_template["outbounds"] = outbounds + json_template["outbounds"]
         self.config.append(json_template)
@@ -421,7 +419,7 @@ class V2rayJsonConfig(str):
     def render(self, reverse=False):
         if reverse:
             self.config.reverse()
-        return json.dumps(self.config, indent=4)
+        return dump_json(self.config)
 
     @staticmethod
     def tls_config(sni=None, fp=None, alpn=None, ais=None):
@@ -895,8 +893,7 @@ class V2rayJsonConfig(str):
             max_concurrent_uploads=inbound.get('max_concurrent_uploads', 10),
         )
 
-        mux_json = json.loads(self.mux_template)
-        mux_config = mux_json["v2ray"]
+        mux_config = copy_json(self.mux_template["v2ray"])
 
         if inbound.get('mux_enable', False):
             outbound["mux"] = mux_config
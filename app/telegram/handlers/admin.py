@@ -40,9 +40,10 @@ def get_system_info():
     cpu = cpu_usage()
     with GetDB() as db:
         bandwidth = crud.get_system_usage(db)
-        total_users = crud.get_users_count(db)
-        active_users = crud.get_users_count(db, UserStatus.active)
-        onhold_users = crud.get_users_count(db, UserStatus.on_hold)
+        users_count = crud.get_users_count_by_status(db)
+        total_users = sum(users_count.values())
+        active_users = users_count[UserStatus.active]
+        onhold_users = users_count[UserStatus.on_hold]
     return """\
 🎛 *CPU 核心数*: `{cpu_cores}`
 🖥 *CPU 使用率*: `{cpu_percent}%`
@@ -188,12 +189,13 @@ def reset_usage_user_command(call: types.CallbackQuery):
 @bot.callback_query_handler(cb_query_equals('edit_all'), is_admin=True)
 def edit_all_command(call: types.CallbackQuery):
     with GetDB() as db:
-        total_users = crud.get_users_count(db)
-        active_users = crud.get_users_count(db, UserStatus.active)
-        disabled_users = crud.get_users_count(db, UserStatus.disabled)
-        expired_users = crud.get_users_count(db, UserStatus.expired)
-        limited_users = crud.get_users_count(db, UserStatus.limited)
-        onhold_users = crud.get_users_count(db, UserStatus.on_hold)
+        users_count = crud.get_users_count_by_status(db)
+        total_users = sum(users_count.values())
+        active_users = users_count[UserStatus.active]
+        disabled_users = users_count[UserStatus.disabled]
+        expired_users = users_count[UserStatus.expired]
+        limited_users = users_count[UserStatus.limited]
+        onhold_users = users_count[UserStatus.on_hold]
         text = f'''
 👥 *总用户数*: `{total_users}`
 ✅ *激活用户*: `{active_users}`
@@ -1,7 +1,9 @@
+import json
 from datetime import datetime
-from typing import Union
+from typing import Any, Callable, Dict, Tuple, Union
 
 import jinja2
+from jinja2 import nodes
 
 from config import CUSTOM_TEMPLATES_DIRECTORY
 
@@ -12,10 +14,76 @@ if CUSTOM_TEMPLATES_DIRECTORY:
     # User's templates have priority over default templates
     template_directories.insert(0, CUSTOM_TEMPLATES_DIRECTORY)
 
-env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_directories))
+env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(template_directories),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+)
 env.filters.update(CUSTOM_FILTERS)
 env.globals['now'] = datetime.utcnow
+# globals whose value changes between renders
+VOLATILE_GLOBALS = {'now'}
 
 
 def render_template(template: str, context: Union[dict, None] = None) -> str:
     return env.get_template(template).render(context or {})
+
+
+_assets: Dict[Tuple[str, Callable], Tuple[jinja2.Template, Any]] = {}
+_volatile: Dict[str, Tuple[jinja2.Template, bool]] = {}
+
+
+def is_volatile(template: str) -> bool:
+    """
+    Whether the template uses a global like `now()`, so it renders differently
+    every time. Only the template's own source is checked, not its includes.
+    """
+    source = env.get_template(template)
+    cached = _volatile.get(template)
+    if cached and cached[0] is source:
+        return cached[1]
+
+    text = env.loader.get_source(env, template)[0]
+    volatile = any(name.name in VOLATILE_GLOBALS for name in env.parse(text).find_all(nodes.Name))
+    _volatile[template] = (source, volatile)
+    return volatile
+
+
+def get_asset(template: str, build: Callable[[str], Any]) -> Any:
+    """
+    Returns `build(template)`, built once and rebuilt only after the template
+    file changes on disk (jinja hands out a new template object then).
+    Volatile templates are built on every call.
+    """
+    source = env.get_template(template)
+    key = (template, build)
+    cached = _assets.get(key)
+    if cached and cached[0] is source:
+        return cached[1]
+
+    asset = build(template)
+    if not is_volatile(template):
+        _assets[key] = (source, asset)
+    return asset
+
+
+def parse_json_template(template: str) -> Any:
+    return json.loads(render_template(template))
+
+
+def get_json_template(template: str) -> Any:
+    """
+    Rendered and parsed json template, shared between callers.
+    It must not be modified, use `copy_json` to get a private copy.
+    """
+    return get_asset(template, parse_json_template)
+
+
+def copy_json(obj: Any) -> Any:
+    """
+    A much faster deepcopy for json-like data.
+    """
+    if isinstance(obj, dict):
+        return {key: copy_json(val) for key, val in obj.items()}
+    if isinstance(obj, list):
+        return [copy_json(val) for val in obj]
+    return obj
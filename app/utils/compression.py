@@ -0,0 +1,172 @@
+import logging
+import zlib
+from typing import Optional, Set
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import RESPONSE_COMPRESSION, RESPONSE_COMPRESSION_MIN_SIZE
+
+try:
+    import brotli
+except ImportError:  # optional, only needed for RESPONSE_COMPRESSION=br
+    brotli = None
+
+logger = logging.getLogger('uvicorn.error')
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+ENCODING = (RESPONSE_COMPRESSION or "").lower() or None
+if ENCODING == "br" and brotli is None:
+    logger.warning("RESPONSE_COMPRESSION is set to br but the brotli package is not installed, using gzip")
+    ENCODING = "gzip"
+elif ENCODING not in (None, "gzip", "br"):
+    raise ValueError(f'Unsupported RESPONSE_COMPRESSION "{RESPONSE_COMPRESSION}", use gzip or br')
+
+
+class GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+COMPRESSORS = {
+    "gzip": GzipCompressor,
+    "br": BrotliCompressor,
+}
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(data) + compressor.flush()
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    encodings = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    The content encoding to use for a request, None if responses shouldn't be compressed.
+    """
+    if not ENCODING or not accept_encoding:
+        return
+
+    accepted = accepted_encodings(accept_encoding)
+    if ENCODING in accepted or "*" in accepted:
+        return ENCODING
+    if "gzip" in accepted:
+        return "gzip"
+
+
+class CompressionMiddleware:
+    """
+    Like starlette's GZipMiddleware, with brotli support, and leaving alone responses
+    that are already encoded (e.g. pre-compressed subscriptions) or not compressible.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = RESPONSE_COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            encoding = negotiate(Headers(scope=scope).get("Accept-Encoding", ""))
+            if encoding:
+                responder = CompressionResponder(self.app, self.minimum_size, encoding)
+                await responder(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, minimum_size: int, encoding: str):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoding = encoding
+        self.send: Send = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # held back until the first body message tells whether to compress
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            )
+            return
+
+        if message_type != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            if self.passthrough or (len(body) < self.minimum_size and not more_body):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            self.compressor = COMPRESSORS[self.encoding]()
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                message["body"] = self.compressor.compress(body)
+            else:
+                message["body"] = self.compressor.compress(body) + self.compressor.flush()
+                headers["Content-Length"] = str(len(message["body"]))
+
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        if not self.passthrough:
+            message["body"] = self.compressor.compress(body)
+            if not more_body:
+                message["body"] += self.compressor.flush()
+
+        await self.send(message)
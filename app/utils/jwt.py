@@ -8,7 +8,12 @@ from typing import Union
 
 from jose import JWTError, jwt
 
-from config import JWT_ACCESS_TOKEN_EXPIRE_MINUTES
+from app.utils.store import LRUCache
+from config import AUTH_CACHE_SIZE, JWT_ACCESS_TOKEN_EXPIRE_MINUTES
+
+# (kind, token) -> payload, only valid tokens are kept. The secret key never
+# changes while the panel runs, so the tokens stay valid until they expire
+_verified_tokens = LRUCache(max_size=AUTH_CACHE_SIZE)
 
 
 @lru_cache(maxsize=None)
@@ -27,7 +32,22 @@ def create_admin_token(username: str, is_sudo=False) -> str:
     return encoded_jwt
 
 
+def get_verified(kind: str, token: str) -> Union[dict, None]:
+    return _verified_tokens.get((kind, token))
+
+
+def set_verified(kind: str, token: str, payload: dict, expires_at: Union[float, None] = None):
+    if expires_at is None:
+        _verified_tokens.set((kind, token), payload)
+    elif expires_at > time.time():
+        _verified_tokens.set((kind, token), payload, ttl=expires_at - time.time())
+
+
 def get_admin_payload(token: str) -> Union[dict, None]:
+    verified = get_verified("admin", token)
+    if verified:
+        return verified
+
     try:
         payload = jwt.decode(token, get_secret_key(), algorithms=["HS256"])
         username: str = payload.get("sub")
@@ -39,7 +59,9 @@ def get_admin_payload(token: str) -> Union[dict, None]:
         except KeyError:
             created_at = None
 
-        return {"username": username, "is_sudo": access == "sudo", "created_at": created_at}
+        verified = {"username": username, "is_sudo": access == "sudo", "created_at": created_at}
+        set_verified("admin", token, verified, payload.get("exp"))
+        return verified
     except JWTError:
         return
 
@@ -58,6 +80,10 @@ def create_subscription_token(username: str) -> str:
 
 
 def get_subscription_payload(token: str) -> Union[dict, None]:
+    verified = get_verified("subscription", token)
+    if verified:
+        return verified
+
     try:
         if len(token) < 15:
             return
@@ -65,7 +91,9 @@ def get_subscription_payload(token: str) -> Union[dict, None]:
         if token.startswith("eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9."):
             payload = jwt.decode(token, get_secret_key(), algorithms=["HS256"])
             if payload.get("access") == "subscription":
-                return {"username": payload['sub'], "created_at": datetime.utcfromtimestamp(payload['iat'])}
+                verified = {"username": payload['sub'], "created_at": datetime.utcfromtimestamp(payload['iat'])}
+                set_verified("subscription", token, verified, payload.get("exp"))
+                return verified
             else:
                 return
         else:
@@ -83,7 +111,9 @@ def get_subscription_payload(token: str) -> Union[dict, None]:
             if u_signature == u_token_resign:
                 u_username = u_token_dec_str.split(',')[0]
                 u_created_at = int(u_token_dec_str.split(',')[1])
-                return {"username": u_username, "created_at": datetime.utcfromtimestamp(u_created_at)}
+                verified = {"username": u_username, "created_at": datetime.utcfromtimestamp(u_created_at)}
+                set_verified("subscription", token, verified)
+                return verified
             else:
                 return
     except JWTError:
@@ -0,0 +1,295 @@
+"""
+Leader election between the worker processes of the panel (UVICORN_WORKERS),
+or the standalone worker started with `marzban-cli worker` (STANDALONE_WORKER).
+
+Exactly one process, the leader, runs the jobs and owns the xray core and the
+nodes, the others forward their core and node operations to it through
+LEADER_SOCKET. The leadership is an exclusive lock on a file next to the
+socket, so it's released by the kernel when the leader exits and the first
+follower to take it over becomes the new leader. Both are only accessible
+to the user running the panel.
+"""
+import fcntl
+import inspect
+import logging
+import os
+import socket
+import socketserver
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from threading import Event, Thread
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.utils.serialization import dumpb, loads
+from config import LEADER_SOCKET, STANDALONE_WORKER, UVICORN_WORKERS
+
+logger = logging.getLogger('uvicorn.error')
+
+# seconds between the attempts of followers to take the leadership over
+ELECTION_INTERVAL = 5
+# seconds an operation waits for a new leader to be elected when there's none
+FAILOVER_TIMEOUT = ELECTION_INTERVAL * 2
+
+_leader = False
+_lock_file = None
+_server: Optional[socketserver.UnixStreamServer] = None
+_on_elected: List[Callable] = []
+_handlers: Dict[str, Callable] = {}
+
+
+class LeaderError(Exception):
+    """
+    An operation couldn't be forwarded to the leader, or failed on it.
+    """
+
+
+def enabled() -> bool:
+    return UVICORN_WORKERS > 1 or STANDALONE_WORKER
+
+
+def is_leader() -> bool:
+    return _leader or not enabled()
+
+
+def on_elected(func: Callable) -> Callable:
+    """
+    Registers `func` to be called once this process becomes the leader,
+    at startup with a single worker.
+    """
+    _on_elected.append(func)
+    return func
+
+
+def only(func: Callable) -> Callable:
+    """
+    Wraps a job to only run on the leader.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if is_leader():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def handler(op: str) -> Callable:
+    """
+    Registers the function running an operation forwarded to the leader,
+    a generator function streams what it yields (None keeps the stream alive).
+    """
+    def decorator(func: Callable) -> Callable:
+        _handlers[op] = func
+        return func
+    return decorator
+
+
+def campaign() -> bool:
+    """
+    Makes this process the leader if no one else is.
+    """
+    global _leader, _lock_file
+
+    if _leader:
+        return True
+
+    if enabled():
+        os.makedirs(os.path.dirname(os.path.abspath(LEADER_SOCKET)), exist_ok=True)
+        lock_file = os.fdopen(os.open(f"{LEADER_SOCKET}.lock", os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _lock_file = lock_file
+        _serve()
+        logger.info(f"Process {os.getpid()} is elected as the leader")
+
+    _leader = True
+    for func in _on_elected:
+        try:
+            func()
+        except Exception:
+            logger.exception(f"Error in {func.__name__} on election")
+    return True
+
+
+def campaign_until_elected(scheduler) -> None:
+    """
+    Campaigns now, then every ELECTION_INTERVAL seconds on `scheduler` until elected.
+    """
+    if not campaign():
+        logger.info("Another process is the leader, forwarding core and node operations to it")
+        scheduler.add_job(campaign, 'interval', seconds=ELECTION_INTERVAL, coalesce=True, max_instances=1)
+
+
+def resign() -> None:
+    global _leader, _lock_file, _server
+
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+        try:
+            os.remove(LEADER_SOCKET)
+        except FileNotFoundError:
+            pass
+
+    if _lock_file:
+        _lock_file.close()
+        _lock_file = None
+
+    _leader = False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def reply(self, **reply):
+        self.wfile.write(dumpb(reply) + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        result = None
+        try:
+            request = loads(self.rfile.readline())
+            result = _handlers[request["op"]](**request.get("args", {}))
+            if not inspect.isgenerator(result):
+                return self.reply(result=result)
+
+            for item in result:
+                self.reply(result=item)
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as exc:
+            logger.exception("Error in a forwarded operation")
+            try:
+                self.reply(error=str(exc))
+            except OSError:
+                pass
+        finally:
+            if inspect.isgenerator(result):
+                result.close()
+
+
+def _serve():
+    global _server
+
+    try:
+        os.remove(LEADER_SOCKET)  # left by a leader that didn't exit cleanly
+    except FileNotFoundError:
+        pass
+
+    # the socket is created without permissions for anyone else from the start
+    umask = os.umask(0o177)
+    try:
+        _server = socketserver.ThreadingUnixStreamServer(LEADER_SOCKET, _RequestHandler)
+    finally:
+        os.umask(umask)
+    _server.daemon_threads = True
+    Thread(target=_server.serve_forever, daemon=True).start()
+
+
+def _connect(op: str, timeout: Optional[float], args: dict) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(LEADER_SOCKET)
+        sock.sendall(dumpb({"op": op, "args": args}) + b"\n")
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def call(op: str, timeout: float = 30, failover_timeout: float = FAILOVER_TIMEOUT, **args) -> Any:
+    """
+    Runs an operation on the leader (here if this is the leader) and returns its result.
+    While there's no leader to connect to, e.g. while it's being replaced, it's tried
+    again for up to `failover_timeout` seconds, then LeaderError is raised as it is
+    when the operation is sent but fails or gets no reply.
+    """
+    deadline = time.monotonic() + failover_timeout
+    while True:
+        # the process may have been elected while waiting
+        if is_leader():
+            return _handlers[op](**args)
+
+        try:
+            sock = _connect(op, timeout, args)
+            break
+        except (FileNotFoundError, ConnectionRefusedError) as exc:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Unable to forward \"{op}\" to the leader: {exc}")
+                raise LeaderError("No leader process to run the operation, try again later") from exc
+            time.sleep(0.5)
+        except OSError as exc:
+            logger.warning(f"Unable to forward \"{op}\" to the leader: {exc}")
+            raise LeaderError(f"Unable to forward the operation to the leader: {exc}") from exc
+
+    # not sent again from here on, it may have run already
+    try:
+        with sock:
+            reply = loads(sock.makefile("rb").readline())
+    except (OSError, ValueError) as exc:
+        logger.warning(f"No reply of the leader to \"{op}\": {exc}")
+        raise LeaderError(f"No reply of the leader to the operation: {exc}") from exc
+
+    if "error" in reply:
+        logger.error(f"\"{op}\" failed on the leader: {reply['error']}")
+        raise LeaderError(reply["error"])
+    return reply["result"]
+
+
+class Stream(deque):
+    """
+    Items streamed by the leader, `closed` once the stream ends.
+    """
+    closed = False
+
+
+@contextmanager
+def stream(op: str, maxlen: int = 100, **args) -> Iterator[Stream]:
+    """
+    Collects what an operation streams on the leader (here if this is the leader)
+    until the context exits.
+    """
+    items = Stream(maxlen=maxlen)
+    stop = Event()
+    sock = None
+
+    try:
+        if is_leader():
+            replies = _handlers[op](**args)
+        else:
+            sock = _connect(op, None, args)
+            replies = (loads(line).get("result") for line in sock.makefile("rb"))
+    except OSError as exc:
+        logger.warning(f"Unable to forward \"{op}\" to the leader: {exc}")
+        items.closed = True
+        yield items
+        return
+
+    def collect():
+        try:
+            for item in replies:
+                if stop.is_set():
+                    break
+                if item is not None:
+                    items.append(item)
+        except (OSError, ValueError):
+            pass
+        finally:
+            replies.close()
+            items.closed = True
+
+    Thread(target=collect, daemon=True).start()
+    try:
+        yield items
+    finally:
+        stop.set()
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
@@ -1,15 +1,22 @@
-from collections import deque
+import logging
 from datetime import datetime as dt
 from enum import Enum
 from typing import Type
 
-from pydantic import BaseModel
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field
+from sqlalchemy.exc import SQLAlchemyError
 
 from config import WEBHOOK_ADDRESS
 from app.models.admin import Admin
 from app.models.user import UserResponse
+from app.utils.serialization import dumps
 
-queue = deque()
+# the share links are the bulk of a user and the slowest part to build,
+# the subscription url is enough for the webhooks
+PAYLOAD_EXCLUDE = {"user": {"links"}}
+
+logger = logging.getLogger('uvicorn.error')
 
 
 class Notification(BaseModel):
@@ -27,10 +34,12 @@ class Notification(BaseModel):
         reached_usage_percent = "reached_usage_percent"
         reached_days_left = "reached_days_left"
 
-    enqueued_at: float = dt.utcnow().timestamp()
-    send_at: float = dt.utcnow().timestamp()
+    enqueued_at: float = Field(default_factory=lambda: dt.utcnow().timestamp())
     tries: int = 0
 
+    def payload(self) -> str:
+        return dumps(jsonable_encoder(self, exclude=PAYLOAD_EXCLUDE))
+
 
 class UserNotification(Notification):
     username: str
@@ -95,11 +104,20 @@ class UserDataUsageReset(UserNotification):
 
 
 class UserSubscriptionRevoked(UserNotification):
-    action = Notification.Type = Notification.Type.subscription_revoked
+    action: Notification.Type = Notification.Type.subscription_revoked
     by: Admin
     user: UserResponse
 
 
 def notify(message: Type[Notification]) -> None:
+    """
+    Stores the notification to be sent to every webhook by the send_notifications job.
+    """
     if WEBHOOK_ADDRESS:
-        queue.append(message)
+        from app.db import GetDB, crud
+
+        try:
+            with GetDB() as db:
+                crud.create_webhook_notifications(db, message.payload(), WEBHOOK_ADDRESS)
+        except SQLAlchemyError as exc:
+            logger.error(f"Unable to store the {message.action} notification of {message.username}: {exc}")
@@ -0,0 +1,46 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional, json is used instead
+    orjson = None
+
+
+def dumpb(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """
+    Serializes `obj` to utf-8 json, with orjson if it's installed.
+    Indented output uses 2 spaces either way.
+    """
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:  # e.g. non-string keys or integers over 64 bits, that json handles
+            pass
+
+    if indent:
+        return json.dumps(obj, indent=2, sort_keys=sort_keys, ensure_ascii=False).encode()
+    return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys, ensure_ascii=False).encode()
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    return dumpb(obj, indent=indent, sort_keys=sort_keys).decode()
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    The default response class of the API, JSONResponse rendered with `dumpb`.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumpb(content)
+
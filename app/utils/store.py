@@ -1,3 +1,17 @@
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from math import ceil
+from threading import Lock, Thread
+from typing import Callable, Dict, Set
+from uuid import uuid4
+
+from app.utils.serialization import dumpb, loads
+from config import AUTH_CACHE_SIZE, CACHE_REDIS_URL
+
+logger = logging.getLogger('uvicorn.error')
+
+
 class MemoryStorage:
     def __init__(self):
         self._data = {}
@@ -85,3 +99,210 @@ class DictStorage(dict):
 
     def update(self):
         self.update_func(self)
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping that evicts the least recently used key
+    when full and, if `ttl` is given, forgets keys older than `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCache:
+    """
+    Cache shared by the processes of the panel through redis, or kept in process
+    memory without `redis_url`, for a single process. Keys live in namespaces,
+    each with a version stamp that's part of their keys, so bumping it drops the
+    whole namespace at once. Bumps are published to the other processes, which
+    then run the callbacks registered for the namespace with `on_bump`.
+    Values are stored in redis as json. Errors of redis are logged and taken as
+    cache misses, bumps that failed are made again before the cache is used.
+    """
+    prefix = "marzban:cache:"
+
+    def __init__(self, redis_url: str = "", max_size: int = 1024, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.origin = uuid4().hex
+        self._versions: Dict[str, int] = {}
+        self._pending_bumps: Set[str] = set()
+        self._callbacks: Dict[str, list] = defaultdict(list)
+        self._memory: Dict[str, LRUCache] = defaultdict(lambda: LRUCache(max_size=self.max_size))
+
+        self.redis = None
+        if redis_url:
+            import redis
+
+            self.redis = redis.Redis.from_url(redis_url)
+            Thread(target=self._listen, daemon=True).start()
+
+    def on_bump(self, namespace: str) -> Callable:
+        """
+        Registers a callback for bumps of `namespace` made by other processes.
+        """
+        def decorator(func: Callable) -> Callable:
+            self._callbacks[namespace].append(func)
+            return func
+        return decorator
+
+    def version(self, namespace: str) -> int:
+        try:
+            return self._versions[namespace]
+        except KeyError:
+            pass
+
+        if self.redis is None:
+            return self._versions.setdefault(namespace, 0)
+
+        try:
+            version = int(self.redis.hget(self.prefix + "versions", namespace) or 0)
+        except Exception as exc:
+            logger.warning(f"Unable to get the version of \"{namespace}\" cache: {exc}")
+            return 0
+        return self._versions.setdefault(namespace, version)
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{self.version(namespace)}:{key}"
+
+    def get(self, namespace: str, key: str, default=None):
+        if self.redis is None:
+            return self._memory[namespace].get(self._key(namespace, key), default)
+
+        try:
+            self._retry_bumps()
+            value = self.redis.get(self._key(namespace, key))
+        except Exception as exc:
+            logger.warning(f"Unable to get \"{namespace}\" cache: {exc}")
+            return default
+        return default if value is None else loads(value)
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        ttl = ttl or self.ttl
+        if self.redis is None:
+            return self._memory[namespace].set(self._key(namespace, key), value, ttl=ttl)
+
+        try:
+            self._retry_bumps()
+            self.redis.set(self._key(namespace, key), dumpb(value), ex=ceil(ttl))
+        except Exception as exc:
+            logger.warning(f"Unable to set \"{namespace}\" cache: {exc}")
+
+    def delete(self, namespace: str, key: str):
+        if self.redis is None:
+            return self._memory[namespace].delete(self._key(namespace, key))
+
+        try:
+            self.redis.delete(self._key(namespace, key))
+        except Exception as exc:
+            logger.warning(f"Unable to delete from \"{namespace}\" cache: {exc}")
+
+    def bump(self, namespace: str) -> int:
+        """
+        Drops every entry of `namespace` and lets the other processes know.
+        """
+        if self.redis is None:
+            self._memory[namespace].clear()
+            version = self._versions[namespace] = self.version(namespace) + 1
+            return version
+
+        try:
+            return self._bump(namespace)
+        except Exception as exc:
+            # the version is only ever taken from redis, the bump is made again
+            # before the next use of the cache and the cache is skipped until then
+            logger.warning(f"Unable to bump the version of \"{namespace}\" cache, retrying later: {exc}")
+            self._pending_bumps.add(namespace)
+            return self._versions.get(namespace, 0)
+
+    def _bump(self, namespace: str) -> int:
+        version = self.redis.hincrby(self.prefix + "versions", namespace)
+        self._versions[namespace] = version
+        self.redis.publish(self.prefix + "bumps", f"{self.origin} {namespace} {version}")
+        return version
+
+    def _retry_bumps(self):
+        for namespace in list(self._pending_bumps):
+            self._bump(namespace)
+            self._pending_bumps.discard(namespace)
+            logger.info(f"Bumped the version of \"{namespace}\" cache")
+
+    def _bumped(self, namespace: str, version: int):
+        if self._versions.get(namespace) == version:
+            return
+
+        # what's reloaded by the callbacks meanwhile reads the version from redis
+        self._versions.pop(namespace, None)
+        for func in self._callbacks[namespace]:
+            try:
+                func()
+            except Exception:
+                logger.exception(f"Error in {func.__name__} on a bump of \"{namespace}\" cache")
+        self._versions[namespace] = version
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.prefix + "bumps")
+                self._retry_bumps()
+
+                # bumps missed while not subscribed
+                versions = self.redis.hgetall(self.prefix + "versions")
+                for namespace, version in versions.items():
+                    if namespace.decode() in self._versions:
+                        self._bumped(namespace.decode(), int(version))
+
+                for message in pubsub.listen():
+                    origin, namespace, version = message["data"].decode().split()
+                    if origin != self.origin:
+                        self._bumped(namespace, int(version))
+
+            except Exception as exc:
+                logger.warning(f"Lost the cache invalidation channel, reconnecting: {exc}")
+                time.sleep(5)
+
+
+shared_cache = SharedCache(CACHE_REDIS_URL, max_size=AUTH_CACHE_SIZE)
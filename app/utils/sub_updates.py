@@ -0,0 +1,36 @@
+from datetime import datetime
+from threading import Lock
+from typing import Dict, List, Tuple
+
+# user_id -> (sub_updated_at, sub_last_user_agent), the last fetch wins
+_updates: Dict[int, Tuple[datetime, str]] = {}
+_lock = Lock()
+
+
+def queue(user_id: int, user_agent: str) -> None:
+    with _lock:
+        _updates[user_id] = (datetime.utcnow(), user_agent)
+
+
+def pop_all() -> List[dict]:
+    global _updates
+
+    with _lock:
+        updates, _updates = _updates, {}
+
+    return [
+        {"uid": user_id, "sub_updated": updated_at, "sub_agent": user_agent}
+        for user_id, (updated_at, user_agent) in updates.items()
+    ]
+
+
+def requeue(updates: List[dict]) -> None:
+    """
+    Puts back updates popped by `pop_all` that couldn't be written,
+    unless a newer fetch of the same user was queued meanwhile.
+    """
+    with _lock:
+        for update in updates:
+            queued = _updates.get(update["uid"])
+            if queued is None or queued[0] < update["sub_updated"]:
+                _updates[update["uid"]] = (update["sub_updated"], update["sub_agent"])
@@ -9,6 +9,7 @@ import requests
 import ipaddress
 
 from app import scheduler
+from app.utils import leader
 
 
 @dataclass
@@ -72,6 +73,7 @@ rt_bw = RealtimeBandwidth(
 
 # sample time is 2 seconds, values lower than this may not produce good results
 @scheduler.scheduled_job("interval", seconds=2, coalesce=True, max_instances=1)
+@leader.only
 def record_realtime_bandwidth() -> None:
     global rt_bw
     last_perf_counter = rt_bw.last_perf_counter
@@ -84,13 +86,26 @@ def record_realtime_bandwidth() -> None:
     rt_bw.outgoing_packets, rt_bw.packets_sent = round((io.packets_sent - rt_bw.packets_sent) / sample_time), io.packets_sent
 
 
+@leader.handler("realtime_bandwidth")
+def _realtime_bandwidth() -> dict:
+    return {
+        "incoming_bytes": rt_bw.incoming_bytes,
+        "outgoing_bytes": rt_bw.outgoing_bytes,
+        "incoming_packets": rt_bw.incoming_packets,
+        "outgoing_packets": rt_bw.outgoing_packets,
+    }
+
+
 def realtime_bandwidth() -> RealtimeBandwidthStat:
-    return RealtimeBandwidthStat(
-        incoming_bytes=rt_bw.incoming_bytes,
-        outgoing_bytes=rt_bw.outgoing_bytes,
-        incoming_packets=rt_bw.incoming_packets,
-        outgoing_packets=rt_bw.outgoing_packets,
-    )
+    # sampled by the leader only
+    try:
+        # best effort, polled by the dashboard, zeros rather than waiting for a new leader
+        stats = leader.call("realtime_bandwidth", timeout=5, failover_timeout=0)
+    except leader.LeaderError:
+        stats = None
+    if not stats:
+        return RealtimeBandwidthStat(incoming_bytes=0, outgoing_bytes=0, incoming_packets=0, outgoing_packets=0)
+    return RealtimeBandwidthStat(**stats)
 
 
 def random_password() -> str:
@@ -0,0 +1,74 @@
+import time
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.models.user import UserStatus
+from config import USERS_COUNT_CACHE_TTL
+
+# admin id (None for users without an admin) -> status -> count
+_counts: Optional[Dict[Optional[int], Dict[UserStatus, int]]] = None
+_loaded_at = 0.0
+_lock = Lock()
+
+
+def enabled() -> bool:
+    return USERS_COUNT_CACHE_TTL > 0
+
+
+def empty_counts() -> Dict[UserStatus, int]:
+    return {status: 0 for status in UserStatus}
+
+
+def load(rows: Iterable[Tuple[Optional[int], str, int]]) -> None:
+    """
+    Replaces the counters with (admin_id, status, count) rows, they are
+    reloaded this way once USERS_COUNT_CACHE_TTL passes, which also picks up
+    changes made by other processes.
+    """
+    global _counts, _loaded_at
+
+    counts = {}
+    for admin_id, status, count in rows:
+        counts.setdefault(admin_id, empty_counts())[UserStatus(status)] = count
+
+    with _lock:
+        _counts, _loaded_at = counts, time.monotonic()
+
+
+def get(admin_id: Optional[int] = None, all_admins: bool = True) -> Optional[Dict[UserStatus, int]]:
+    """
+    Counts of every status, of all users or of an admin's users.
+    None if they have to be (re)loaded.
+    """
+    with _lock:
+        if _counts is None or time.monotonic() - _loaded_at > USERS_COUNT_CACHE_TTL:
+            return
+
+        if not all_admins:
+            return dict(_counts.get(admin_id) or empty_counts())
+
+        counts = empty_counts()
+        for admin_counts in _counts.values():
+            for status, count in admin_counts.items():
+                counts[status] += count
+        return counts
+
+
+def add(admin_id: Optional[int], status: str, n: int = 1) -> None:
+    with _lock:
+        if _counts is not None:
+            _counts.setdefault(admin_id, empty_counts())[UserStatus(status)] += n
+
+
+def move(old_admin_id: Optional[int], old_status: str, new_admin_id: Optional[int], new_status: str) -> None:
+    if old_admin_id == new_admin_id and UserStatus(old_status) == UserStatus(new_status):
+        return
+    add(old_admin_id, old_status, -1)
+    add(new_admin_id, new_status)
+
+
+def invalidate() -> None:
+    global _counts
+
+    with _lock:
+        _counts = None
@@ -2,7 +2,7 @@ from typing import List, Optional
 
 import sqlalchemy
 from app import app
-from app.db import Session, crud, get_db
+from app.db import Session, crud, get_db, get_read_db
 from app.models.admin import Admin, AdminCreate, AdminInDB, AdminModify, Token
 from app.utils.jwt import create_admin_token
 from config import SUDOERS
@@ -131,7 +131,7 @@ def get_current_admin(admin: Admin = Depends(Admin.get_current)):
 def get_admins(offset: int = None,
                limit: int = None,
                username: str = None,
-               db: Session = Depends(get_db),
+               db: Session = Depends(get_read_db),
                admin: Admin = Depends(Admin.get_current)):
 
     if not admin.is_sudo:
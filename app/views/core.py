@@ -10,6 +10,8 @@ from app import app, xray
 from app.db import Session, get_db
 from app.models.admin import Admin
 from app.models.core import CoreStats
+from app.subscription.cache import bump_version
+from app.utils import leader
 from app.xray import XRayConfig
 from config import XRAY_JSON
 
@@ -41,7 +43,7 @@ async def core_logs(websocket: WebSocket, db: Session = Depends(get_db)):
 
     cache = ''
     last_sent_ts = 0
-    with xray.core.get_logs() as logs:
+    with leader.stream("core_logs") as logs:
         while True:
             if interval and time.time() - last_sent_ts >= interval and cache:
                 try:
@@ -52,6 +54,8 @@ async def core_logs(websocket: WebSocket, db: Session = Depends(get_db)):
                 last_sent_ts = time.time()
 
             if not logs:
+                if logs.closed:
+                    break
                 try:
                     await asyncio.wait_for(websocket.receive(), timeout=0.2)
                     continue
@@ -76,7 +80,7 @@ async def core_logs(websocket: WebSocket, db: Session = Depends(get_db)):
 def get_core_stats(admin: Admin = Depends(Admin.get_current)):
     return CoreStats(
         version=xray.core.version,
-        started=xray.core.started,
+        started=bool(leader.call("core_started")),
         logs_websocket=app.url_path_for('core_logs')
     )
 
@@ -86,11 +90,7 @@ def restart_core(admin: Admin = Depends(Admin.get_current)):
     if not admin.is_sudo:
         raise HTTPException(status_code=403, detail="You're not allowed")
 
-    startup_config = xray.config.include_db_users()
-    xray.core.restart(startup_config)
-    for node_id, node in list(xray.nodes.items()):
-        if node.connected:
-            xray.operations.restart_node(node_id, startup_config)
+    xray.operations.restart_core()
     return {}
 
 
@@ -119,12 +119,9 @@ def modify_core_config(payload: dict, admin: Admin = Depends(Admin.get_current))
     with open(XRAY_JSON, 'w') as f:
         f.write(json.dumps(payload, indent=4))
 
-    startup_config = xray.config.include_db_users()
-    xray.core.restart(startup_config)
-    for node_id, node in list(xray.nodes.items()):
-        if node.connected:
-            xray.operations.restart_node(node_id, startup_config)
+    xray.operations.restart_core(config_modified=True)
 
     xray.hosts.update()
+    bump_version("config")
 
     return payload
@@ -5,14 +5,16 @@ from typing import List
 
 import sqlalchemy
 from fastapi import BackgroundTasks, Depends, HTTPException, WebSocket
+from starlette.concurrency import run_in_threadpool
 from starlette.websockets import WebSocketDisconnect
 
 from app import app, logger, xray
-from app.db import Session, crud, get_db
+from app.db import Session, crud, get_db, get_read_db
 from app.models.admin import Admin
 from app.models.node import (NodeCreate, NodeModify, NodeResponse,
                              NodeSettings, NodeStatus, NodesUsageResponse)
 from app.models.proxy import ProxyHost
+from app.utils import leader
 
 
 @app.get("/api/node/settings", tags=['Node'], response_model=NodeSettings)
@@ -90,10 +92,15 @@ async def node_logs(node_id: int, websocket: WebSocket, db: Session = Depends(ge
     if not admin.is_sudo:
         return await websocket.close(reason="You're not allowed", code=4403)
 
-    if not xray.nodes.get(node_id):
+    try:
+        connected = await run_in_threadpool(leader.call, "node_connected", node_id=node_id)
+    except leader.LeaderError:
+        return await websocket.close(reason="Try again later", code=4503)
+
+    if connected is None:
         return await websocket.close(reason="Node not found", code=4404)
 
-    if not xray.nodes[node_id].connected:
+    if not connected:
         return await websocket.close(reason="Node is not connected", code=4400)
 
     interval = websocket.query_params.get('interval')
@@ -109,12 +116,8 @@ async def node_logs(node_id: int, websocket: WebSocket, db: Session = Depends(ge
 
     cache = ''
     last_sent_ts = 0
-    node = xray.nodes[node_id]
-    with node.get_logs() as logs:
+    with leader.stream("node_logs", node_id=node_id) as logs:
         while True:
-            if not node == xray.nodes[node_id]:
-                break
-
             if interval and time.time() - last_sent_ts >= interval and cache:
                 try:
                     await websocket.send_text(cache)
@@ -124,6 +127,8 @@ async def node_logs(node_id: int, websocket: WebSocket, db: Session = Depends(ge
                 last_sent_ts = time.time()
 
             if not logs:
+                if logs.closed:
+                    break
                 try:
                     await asyncio.wait_for(websocket.receive(), timeout=0.2)
                     continue
@@ -218,7 +223,7 @@ def remove_node(node_id: int,
 
 
 @app.get("/api/nodes/usage", tags=['Node'], response_model=NodesUsageResponse)
-def get_usage(db: Session = Depends(get_db),
+def get_usage(db: Session = Depends(get_read_db),
               start: str = None,
               end: str = None,
               admin: Admin = Depends(Admin.get_current)):
@@ -1,41 +1,129 @@
-import re
 from datetime import datetime
-from distutils.version import LooseVersion
+from typing import Tuple, Union
 
 from fastapi import Depends, Header, HTTPException, Path, Request, Response
 from fastapi.responses import HTMLResponse
 
 from app import app
-from app.db import Session, crud, get_db
-from app.models.user import SubscriptionUserResponse, UserResponse
+from app.db import GetDB, Session, crud, replicas
+from app.db.models import User
+from app.models.user import (SubscriptionUserResponse, UserResponse,
+                             UserSummary)
+from app.subscription.cache import cache as subscription_cache
+from app.subscription.clients import MEDIA_TYPES, Decision, clients
 from app.subscription.share import encode_title, generate_subscription
 from app.templates import render_template
+from app.utils import sub_updates
+from app.utils.compression import compress, negotiate
 from app.utils.jwt import get_subscription_payload
 from config import (
+    RESPONSE_COMPRESSION_MIN_SIZE,
     SUB_PROFILE_TITLE,
     SUB_SUPPORT_URL,
     SUB_UPDATE_INTERVAL,
     SUBSCRIPTION_PAGE_TEMPLATE,
-    USE_CUSTOM_JSON_DEFAULT,
-    USE_CUSTOM_JSON_FOR_STREISAND,
-    USE_CUSTOM_JSON_FOR_V2RAYN,
-    USE_CUSTOM_JSON_FOR_V2RAYNG,
     XRAY_SUBSCRIPTION_PATH
 )
 
 
+def get_subscription_db(token: str):  # Dependency
+    # a user modified moments ago, e.g. whose link was revoked, is read from the primary
+    sub = get_subscription_payload(token)
+    written = sub is not None and replicas.user_recently_written(sub["username"])
+    with GetDB(read_only=not written) as db:
+        yield db
+
+
+def render_subscription(dbuser: User, config_format: str, as_base64: bool, reverse: bool,
+                        encoding: str = None) -> Tuple[bytes, Union[str, None]]:
+    """
+    Returns the body and its content encoding. Bodies are only compressed here
+    when they get cached, so cache hits don't compress them again, otherwise
+    that is left to the compression middleware.
+    """
+    if encoding:
+        body = subscription_cache.get(dbuser, config_format, as_base64, reverse, encoding)
+        if body is not None:
+            return body, encoding
+
+    conf = subscription_cache.get(dbuser, config_format, as_base64, reverse)
+    if conf is None:
+        user: UserSummary = UserSummary.from_orm(dbuser)
+        conf = generate_subscription(
+            user=user, config_format=config_format, as_base64=as_base64, reverse=reverse
+        ).encode()
+        subscription_cache.set(dbuser, config_format, as_base64, reverse, conf)
+
+    if encoding and subscription_cache.enabled and len(conf) >= RESPONSE_COMPRESSION_MIN_SIZE:
+        body = compress(conf, encoding)
+        subscription_cache.set(dbuser, config_format, as_base64, reverse, body, encoding)
+        return body, encoding
+
+    return conf, None
+
+
+def subscription_response(dbuser: User, client: Decision, request: Request, headers: dict) -> Response:
+    body, encoding = render_subscription(
+        dbuser=dbuser,
+        config_format=client.config_format,
+        as_base64=client.as_base64,
+        reverse=client.reverse,
+        encoding=negotiate(request.headers.get("Accept-Encoding", ""))
+    )
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    return Response(content=body, media_type=client.media_type, headers=headers)
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    # weak comparison, as If-None-Match requires
+    etag = etag.removeprefix("W/")
+    return any(
+        tag == "*" or tag.removeprefix("W/") == etag
+        for tag in (t.strip() for t in if_none_match.split(","))
+    )
+
+
+def not_modified(db: Session, sub: dict, client: Decision, request: Request, user_agent: str) -> Union[Response, None]:
+    """
+    Answers a conditional request from the user's version stamp, without
+    loading the user or rendering anything.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return
+
+    stamp = subscription_cache.get_stamp(sub['username'])
+    if stamp is None:
+        stamp = crud.get_user_stamp(db, sub['username'])
+        if not stamp:
+            return
+        subscription_cache.set_stamp(sub['username'], stamp)
+
+    if stamp.created_at > sub['created_at']:
+        return
+    if stamp.sub_revoked_at and stamp.sub_revoked_at > sub['created_at']:
+        return
+
+    etag = subscription_cache.make_etag(stamp, client.config_format, client.as_base64, client.reverse)
+    if etag and etag_matches(etag, if_none_match):
+        sub_updates.queue(stamp.id, user_agent)
+        return Response(status_code=304, headers={"ETag": etag})
+
+
 @app.get("/%s/{token}/" % XRAY_SUBSCRIPTION_PATH, tags=['Subscription'])
 @app.get("/%s/{token}" % XRAY_SUBSCRIPTION_PATH, include_in_schema=False)
 def user_subscription(token: str,
                       request: Request,
-                      db: Session = Depends(get_db),
+                      db: Session = Depends(get_subscription_db),
                       user_agent: str = Header(default="")):
     """
     Subscription link, V2ray and Clash supported
     """
     accept_header = request.headers.get("Accept", "")
 
-    def get_subscription_user_info(user: UserResponse) -> dict:
+    def get_subscription_user_info(user: User) -> dict:
         return {
             "upload": 0,
             "download": user.used_traffic,
@@ -47,6 +135,12 @@ def user_subscription(token: str,
     if not sub:
         return Response(status_code=204)
 
+    if "text/html" not in accept_header:
+        client = clients.match(user_agent)
+        response = not_modified(db, sub, client, request, user_agent)
+        if response:
+            return response
+
     dbuser = crud.get_user(db, sub['username'])
     if not dbuser or dbuser.created_at > sub['created_at']:
         return Response(status_code=204)
@@ -54,83 +148,39 @@ def user_subscription(token: str,
     if dbuser.sub_revoked_at and dbuser.sub_revoked_at > sub['created_at']:
         return Response(status_code=204)
 
-    user: UserResponse = UserResponse.from_orm(dbuser)
-
     if "text/html" in accept_header:
         return HTMLResponse(
             render_template(
                 SUBSCRIPTION_PAGE_TEMPLATE,
-                {"user": user}
+                {"user": UserResponse.from_orm(dbuser)}
             )
         )
 
     response_headers = {
-        "content-disposition": f'attachment; filename="{user.username}"',
+        "content-disposition": f'attachment; filename="{dbuser.username}"',
         "profile-web-page-url": str(request.url),
         "support-url": SUB_SUPPORT_URL,
         "profile-title": encode_title(SUB_PROFILE_TITLE),
         "profile-update-interval": SUB_UPDATE_INTERVAL,
         "subscription-userinfo": "; ".join(
             f"{key}={val}"
-            for key, val in get_subscription_user_info(user).items()
+            for key, val in get_subscription_user_info(dbuser).items()
             if val is not None
         )
     }
 
-    crud.update_user_sub(db, dbuser, user_agent)
-
-    if re.match('^([Cc]lash-verge|[Cc]lash[-\.]?[Mm]eta|[Ff][Ll][Cc]lash|[Mm]ihomo)', user_agent):
-        conf = generate_subscription(user=user, config_format="clash-meta", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="text/yaml", headers=response_headers)
-
-    elif re.match('^([Cc]lash|[Ss]tash)', user_agent):
-        conf = generate_subscription(user=user, config_format="clash", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="text/yaml", headers=response_headers)
-
-    elif re.match('^(SFA|SFI|SFM|SFT|[Kk]aring|[Hh]iddify[Nn]ext)', user_agent):
-        conf = generate_subscription(user=user, config_format="sing-box", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="application/json", headers=response_headers)
-
-    elif re.match('^(SS|SSR|SSD|SSS|Outline|Shadowsocks|SSconf)', user_agent):
-        conf = generate_subscription(user=user, config_format="outline", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="application/json", headers=response_headers)
-
-    elif re.match('^v2rayN/(\d+\.\d+)', user_agent):
-        version_str = re.match('^v2rayN/(\d+\.\d+)', user_agent).group(1)
-        if LooseVersion(version_str) >= LooseVersion("6.40") and \
-                (USE_CUSTOM_JSON_DEFAULT or USE_CUSTOM_JSON_FOR_V2RAYN):
-            conf = generate_subscription(user=user, config_format="v2ray-json", as_base64=False, reverse=False)
-            return Response(content=conf, media_type="application/json", headers=response_headers)
-        else:
-            conf = generate_subscription(user=user, config_format="v2ray", as_base64=True, reverse=False)
-            return Response(content=conf, media_type="text/plain", headers=response_headers)
-
-    elif re.match('^v2rayNG/(\d+\.\d+\.\d+)', user_agent):
-        version_str = re.match('^v2rayNG/(\d+\.\d+\.\d+)', user_agent).group(1)
-        if LooseVersion(version_str) >= LooseVersion("1.8.18") and \
-                (USE_CUSTOM_JSON_DEFAULT or USE_CUSTOM_JSON_FOR_V2RAYNG):
-            conf = generate_subscription(user=user, config_format="v2ray-json", as_base64=False, reverse=True)
-            return Response(content=conf, media_type="application/json", headers=response_headers)
-        else:
-            conf = generate_subscription(user=user, config_format="v2ray", as_base64=True, reverse=False)
-            return Response(content=conf, media_type="text/plain", headers=response_headers)
-
-    elif re.match('^[Ss]treisand', user_agent):
-        if USE_CUSTOM_JSON_DEFAULT or USE_CUSTOM_JSON_FOR_STREISAND:
-            conf = generate_subscription(user=user, config_format="v2ray-json", as_base64=False, reverse=False)
-            return Response(content=conf, media_type="application/json", headers=response_headers)
-        else:
-            conf = generate_subscription(user=user, config_format="v2ray", as_base64=True, reverse=False)
-            return Response(content=conf, media_type="text/plain", headers=response_headers)
+    etag = subscription_cache.make_etag(dbuser, client.config_format, client.as_base64, client.reverse)
+    if etag:
+        response_headers["ETag"] = etag
 
-    else:
-        conf = generate_subscription(user=user, config_format="v2ray", as_base64=True, reverse=False)
-        return Response(content=conf, media_type="text/plain", headers=response_headers)
+    sub_updates.queue(dbuser.id, user_agent)
+
+    return subscription_response(dbuser, client, request, response_headers)
 
 
 @app.get("/%s/{token}/info" % XRAY_SUBSCRIPTION_PATH, tags=['Subscription'], response_model=SubscriptionUserResponse)
 def user_subscription_info(token: str,
-                           db: Session = Depends(get_db)):
+                           db: Session = Depends(get_subscription_db)):
     sub = get_subscription_payload(token)
     if not sub:
         return Response(status_code=404)
@@ -149,7 +199,7 @@ def user_subscription_info(token: str,
 def user_get_usage(token: str,
                    start: str = None,
                    end: str = None,
-                   db: Session = Depends(get_db)):
+                   db: Session = Depends(get_subscription_db)):
 
     sub = get_subscription_payload(token)
     if not sub:
@@ -182,14 +232,14 @@ def user_subscription_with_client_type(
     token: str,
     request: Request,
     client_type: str = Path(..., regex="sing-box|clash-meta|clash|outline|v2ray|v2ray-json"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_subscription_db),
     user_agent: str = Header(default="")
 ):
     """
     Subscription link, v2ray, clash, sing-box, outline and clash-meta supported
     """
 
-    def get_subscription_user_info(user: UserResponse) -> dict:
+    def get_subscription_user_info(user: User) -> dict:
         return {
             "upload": 0,
             "download": user.used_traffic,
@@ -197,10 +247,18 @@ def user_subscription_with_client_type(
             "expire": user.expire if user.expire is not None else 0,
         }
 
+    if client_type not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid subscription type")
+    client = Decision(client_type, as_base64=client_type == "v2ray", reverse=False)
+
     sub = get_subscription_payload(token)
     if not sub:
         return Response(status_code=204)
 
+    response = not_modified(db, sub, client, request, user_agent)
+    if response:
+        return response
+
     dbuser = crud.get_user(db, sub['username'])
     if not dbuser or dbuser.created_at > sub['created_at']:
         return Response(status_code=204)
@@ -208,45 +266,22 @@ def user_subscription_with_client_type(
     if dbuser.sub_revoked_at and dbuser.sub_revoked_at > sub['created_at']:
         return Response(status_code=204)
 
-    user: UserResponse = UserResponse.from_orm(dbuser)
-
     response_headers = {
-        "content-disposition": f'attachment; filename="{user.username}"',
+        "content-disposition": f'attachment; filename="{dbuser.username}"',
         "profile-web-page-url": str(request.url),
         "support-url": SUB_SUPPORT_URL,
         "profile-title": encode_title(SUB_PROFILE_TITLE),
         "profile-update-interval": SUB_UPDATE_INTERVAL,
         "subscription-userinfo": "; ".join(
             f"{key}={val}"
-            for key, val in get_subscription_user_info(user).items()
+            for key, val in get_subscription_user_info(dbuser).items()
         )
     }
 
-    crud.update_user_sub(db, dbuser, user_agent)
-
-    if client_type == "clash-meta":
-        conf = generate_subscription(user=user, config_format="clash-meta", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="text/yaml", headers=response_headers)
+    etag = subscription_cache.make_etag(dbuser, client.config_format, client.as_base64, client.reverse)
+    if etag:
+        response_headers["ETag"] = etag
 
-    elif client_type == "sing-box":
-        conf = generate_subscription(user=user, config_format="sing-box", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="application/json", headers=response_headers)
+    sub_updates.queue(dbuser.id, user_agent)
 
-    elif client_type == "clash":
-        conf = generate_subscription(user=user, config_format="clash", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="text/yaml", headers=response_headers)
-
-    elif client_type == "v2ray":
-        conf = generate_subscription(user=user, config_format="v2ray", as_base64=True, reverse=False)
-        return Response(content=conf, media_type="text/plain", headers=response_headers)
-
-    elif client_type == "outline":
-        conf = generate_subscription(user=user, config_format="outline", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="application/json", headers=response_headers)
-
-    elif client_type == "v2ray-json":
-        conf = generate_subscription(user=user, config_format="v2ray-json", as_base64=False, reverse=False)
-        return Response(content=conf, media_type="application/json", headers=response_headers)
-
-    else:
-        raise HTTPException(status_code=400, detail="Invalid subscription type")
+    return subscription_response(dbuser, client, request, response_headers)
@@ -19,8 +19,7 @@ def get_system_stats(db: Session = Depends(get_db), admin: Admin = Depends(Admin
     system = crud.get_system_usage(db)
     dbadmin: Union[Admin, None] = crud.get_admin(db, admin.username)
 
-    total_user = crud.get_users_count(db, admin=dbadmin if not admin.is_sudo else None)
-    users_active = crud.get_users_count(db, status=UserStatus.active, admin=dbadmin if not admin.is_sudo else None)
+    users_count = crud.get_users_count_by_status(db, admin=dbadmin if not admin.is_sudo else None)
     realtime_bandwidth_stats = realtime_bandwidth()
 
     return SystemStats(
@@ -29,8 +28,8 @@ def get_system_stats(db: Session = Depends(get_db), admin: Admin = Depends(Admin
         mem_used=mem.used,
         cpu_cores=cpu.cores,
         cpu_usage=cpu.percent,
-        total_user=total_user,
-        users_active=users_active,
+        total_user=sum(users_count.values()),
+        users_active=users_count[UserStatus.active],
         incoming_bandwidth=system.uplink,
         outgoing_bandwidth=system.downlink,
         incoming_bandwidth_speed=realtime_bandwidth_stats.incoming_bytes,
@@ -3,13 +3,15 @@ from typing import List, Union
 
 import sqlalchemy
 from fastapi import BackgroundTasks, Depends, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
 
 from app import app, logger, xray
-from app.db import Session, crud, get_db
+from app.db import Session, crud, get_db, get_read_db
 from app.models.admin import Admin
 from app.models.user import (UserCreate, UserModify, UserResponse,
                              UsersResponse, UserStatus, UserUsagesResponse)
 from app.utils import report
+from app.utils.serialization import FastJSONResponse
 
 
 @app.post("/api/user", tags=['User'], response_model=UserResponse)
@@ -225,10 +227,22 @@ def get_users(offset: int = None,
               owner: Union[List[str], None] = Query(None, alias="admin"),
               status: UserStatus = None,
               sort: str = None,
-              db: Session = Depends(get_db),
+              fields: str = None,
+              include_links: bool = True,
+              cursor: str = None,
+              count: str = Query("exact", regex="^(exact|estimated|none)$"),
+              db: Session = Depends(get_read_db),
               admin: Admin = Depends(Admin.get_current)):
     """
     Get all users
+
+    - **fields**: comma separated user fields to return, all of them by default
+    - **include_links**: set to false to skip generating the share links of every user
+    - **cursor**: paginate by cursor instead of offset, empty for the first page then
+    the `next_cursor` of the previous page, which is null on the last one.
+    At most one sort option can be used with it
+    - **count**: `estimated` uses the database statistics when no filter is given,
+    `none` skips counting the users
     """
     if sort is not None:
         opts = sort.strip(',').split(',')
@@ -240,21 +254,47 @@ def get_users(offset: int = None,
                 raise HTTPException(status_code=400,
                                     detail=f'"{opt}" is not a valid sort option')
 
-    users, count = crud.get_users(db=db,
-                                  offset=offset,
-                                  limit=limit,
-                                  search=search,
-                                  usernames=username,
-                                  status=status,
-                                  sort=sort,
-                                  admins=owner if admin.is_sudo else [admin.username],
-                                  return_with_count=True)
+    if cursor is not None and limit:
+        # one more user tells whether there is a next page
+        limit += 1
 
-    return {"users": users, "total": count}
+    try:
+        result = crud.get_users(db=db,
+                                offset=offset,
+                                limit=limit,
+                                search=search,
+                                usernames=username,
+                                status=status,
+                                sort=sort,
+                                admins=owner if admin.is_sudo else [admin.username],
+                                return_with_count=count != "none",
+                                cursor=cursor,
+                                estimated_count=count == "estimated")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    users, total = result if count != "none" else (result, None)
+
+    next_cursor = None
+    if cursor is not None and limit and len(users) == limit:
+        users = users[:-1]
+        next_cursor = crud.encode_users_cursor(users[-1], sort)
+
+    if include_links and not fields:
+        return {"users": users, "total": total, "next_cursor": next_cursor}
+
+    # links are only generated for the users' fields that get serialized
+    include = {"users": {"__all__": set(fields.strip(',').split(','))}, "total": True, "next_cursor": True} \
+        if fields else None
+    exclude = None if include_links else {"users": {"__all__": {"links"}}}
+    return FastJSONResponse(jsonable_encoder(
+        UsersResponse(users=users, total=total, next_cursor=next_cursor), include=include, exclude=exclude
+    ))
 
 
 @app.post("/api/users/reset", tags=['User'])
-def reset_users_data_usage(db: Session = Depends(get_db),
+def reset_users_data_usage(bg: BackgroundTasks,
+                           db: Session = Depends(get_db),
                            admin: Admin = Depends(Admin.get_current)):
     """
     Reset all users data usage
@@ -263,12 +303,9 @@ def reset_users_data_usage(db: Session = Depends(get_db),
         raise HTTPException(status_code=403, detail="You're not allowed")
 
     dbadmin = crud.get_admin(db, admin.username)
-    crud.reset_all_users_data_usage(db=db, admin=dbadmin)
-    startup_config = xray.config.include_db_users()
-    xray.core.restart(startup_config)
-    for node_id, node in list(xray.nodes.items()):
-        if node.connected:
-            xray.operations.restart_node(node_id, startup_config)
+    # only users that were limited are missing from the cores
+    for dbuser in crud.reset_all_users_data_usage(db=db, admin=dbadmin):
+        bg.add_task(xray.operations.add_user, dbuser=dbuser)
     return {}
 
 
@@ -276,7 +313,7 @@ def reset_users_data_usage(db: Session = Depends(get_db),
 def get_user_usage(username: str,
                    start: str = None,
                    end: str = None,
-                   db: Session = Depends(get_db),
+                   db: Session = Depends(get_read_db),
                    admin: Admin = Depends(Admin.get_current)):
     """
     Get users usage
@@ -329,7 +366,7 @@ def set_owner(username: str,
 @app.get("/api/users/expired", tags=['User'], response_model=List[str])
 def get_expired_users(expired_before: datetime = None,
                       expired_after: datetime = None,
-                      db: Session = Depends(get_db),
+                      db: Session = Depends(get_read_db),
                       admin: Admin = Depends(Admin.get_current)):
     """
     Get users who has expired
@@ -338,28 +375,12 @@ def get_expired_users(expired_before: datetime = None,
     - **expired_after** must be an UTC datetime
     """
 
-    expired_before_ts = expired_before.timestamp() if expired_before else 0
-    expired_after_ts = expired_after.timestamp() if expired_after else 0
-    now_ts = datetime.utcnow().timestamp()
-
     dbadmin = crud.get_admin(db, admin.username)
 
-    dbusers = crud.get_users(db=db,
-                             status=[UserStatus.expired, UserStatus.limited],
-                             admin=dbadmin if not admin.is_sudo else None)
-
-    if expired_before and expired_after:
-        expired_users = filter(lambda u: u.expire and u.expire <= now_ts and
-                               u.expire <= expired_before_ts and u.expire >= expired_after_ts, dbusers)
-
-    elif expired_before:
-        expired_users = filter(lambda u: u.expire and u.expire <= now_ts and u.expire <= expired_before_ts, dbusers)
-
-    elif expired_after:
-        expired_users = filter(lambda u: u.expire and u.expire <= now_ts and u.expire >= expired_after_ts, dbusers)
-
-    else:
-        expired_users = dbusers
+    expired_users = crud.get_expired_users(db=db,
+                                           expired_after=expired_after,
+                                           expired_before=expired_before,
+                                           admin=dbadmin if not admin.is_sudo else None)
 
     return [u.username for u in expired_users]
 
@@ -377,30 +398,12 @@ def delete_expired_users(bg: BackgroundTasks,
     - **expired_after** must be an UTC datetime
     """
 
-    expired_before_ts = expired_before.timestamp() if expired_before else 0
-    expired_after_ts = expired_after.timestamp() if expired_after else 0
-    now_ts = datetime.utcnow().timestamp()
-
     dbadmin = crud.get_admin(db, admin.username)
 
-    dbusers = crud.get_users(db=db,
-                             status=[UserStatus.expired, UserStatus.limited],
-                             admin=dbadmin if not admin.is_sudo else None)
-
-    if expired_before and expired_after:
-        expired_users = filter(lambda u: u.expire and u.expire <= now_ts and
-                               u.expire <= expired_before_ts and u.expire >= expired_after_ts, dbusers)
-
-    elif expired_before:
-        expired_users = filter(lambda u: u.expire and u.expire <= now_ts and u.expire <= expired_before_ts, dbusers)
-
-    elif expired_after:
-        expired_users = filter(lambda u: u.expire and u.expire <= now_ts and u.expire >= expired_after_ts, dbusers)
-
-    else:
-        expired_users = dbusers
-
-    expired_users = list(expired_users)
+    expired_users = crud.get_expired_users(db=db,
+                                           expired_after=expired_after,
+                                           expired_before=expired_before,
+                                           admin=dbadmin if not admin.is_sudo else None)
     removed_users = [u.username for u in expired_users]
     crud.remove_users(db, expired_users)
 
@@ -1,8 +1,9 @@
+from hashlib import sha1
 from random import randint
 from typing import TYPE_CHECKING, Dict, Sequence
 
 from app.models.proxy import ProxyHostSecurity
-from app.utils.store import DictStorage
+from app.utils.store import DictStorage, shared_cache
 from app.utils.system import check_port
 from app.xray import operations
 from app.xray.config import XRayConfig
@@ -16,6 +17,8 @@ from xray_api import types
 
 
 core = XRayCore(XRAY_EXECUTABLE_PATH, XRAY_ASSETS_PATH)
+# incremented on every load of `hosts`, what's derived from them is recomputed when it changes
+hosts_generation = 0
 
 # Search for a free API port
 try:
@@ -35,16 +38,15 @@ if TYPE_CHECKING:
     from app.db.models import ProxyHost
 
 
-@DictStorage
-def hosts(storage: dict):
+def load_hosts() -> dict:
     from app.db import GetDB, crud
 
-    storage.clear()
+    hosts = {}
     with GetDB() as db:
         for inbound_tag in config.inbounds_by_tag:
             inbound_hosts: Sequence[ProxyHost] = crud.get_hosts(db, inbound_tag)
 
-            storage[inbound_tag] = [
+            hosts[inbound_tag] = [
                 {
                     "remark": host.remark,
                     "address": host.address,
@@ -65,6 +67,44 @@ def hosts(storage: dict):
                     "random_user_agent": host.random_user_agent,
                 } for host in inbound_hosts if not host.is_disabled
             ]
+    return hosts
+
+
+@DictStorage
+def hosts(storage: dict):
+    """
+    Hosts of every inbound, shared with the other processes through shared_cache
+    until the next bump of "hosts" (crud does it on changes).
+    """
+    global hosts_generation
+
+    storage.clear()
+    # the inbounds of the config they're loaded for
+    key = sha1("\n".join(config.inbounds_by_tag).encode()).hexdigest()
+    inbound_hosts = shared_cache.get("hosts", key)
+    if inbound_hosts is None:
+        inbound_hosts = load_hosts()
+        shared_cache.set("hosts", key, inbound_hosts)
+
+    for inbound_tag, host_list in inbound_hosts.items():
+        storage[inbound_tag] = host_list
+    hosts_generation += 1
+
+
+@shared_cache.on_bump("hosts")
+def drop_hosts():
+    dict.clear(hosts)
+
+
+@shared_cache.on_bump("config")
+def reload_config():
+    """
+    Picks up the config modified by another process, its resolved inbounds go with it.
+    """
+    global config
+
+    config = XRayConfig(XRAY_JSON, api_port=config.api_port)
+    dict.clear(hosts)
 
 
 __all__ = [
@@ -4,7 +4,7 @@ import json
 from collections import defaultdict
 from copy import deepcopy
 from pathlib import PosixPath
-from typing import Union
+from typing import Iterable, List, Union
 
 import commentjson
 from sqlalchemy import func
@@ -13,6 +13,7 @@ from app.db import GetDB
 from app.db import models as db_models
 from app.models.proxy import ProxyTypes
 from app.models.user import UserStatus
+from app.utils import serialization
 from app.utils.crypto import get_cert_SANs
 from config import DEBUG, XRAY_EXCLUDE_INBOUND_TAGS, XRAY_FALLBACKS_INBOUND_TAG
 
@@ -47,6 +48,8 @@ class XRayConfig(dict):
         self.inbounds = []
         self.inbounds_by_protocol = {}
         self.inbounds_by_tag = {}
+        # (protocol, excluded tags) -> inbound tags, see resolve_inbounds
+        self._resolved_tags = {}
         self._fallbacks_inbound = self.get_inbound(XRAY_FALLBACKS_INBOUND_TAG)
         self._resolve_inbounds()
 
@@ -320,13 +323,31 @@ class XRayConfig(dict):
             if inbound['tag'] == tag:
                 return inbound
 
+    def resolve_inbounds(self, protocol: str, excluded_tags: Iterable[str] = ()) -> List[str]:
+        """
+        Tags of the inbounds of `protocol` except `excluded_tags`, in config order.
+        Memoized per exclusion set, which users mostly share, for as long as this
+        config is used (a config change creates a new XRayConfig).
+        """
+        key = (protocol, frozenset(excluded_tags))
+        try:
+            tags = self._resolved_tags[key]
+        except KeyError:
+            if len(self._resolved_tags) >= 4096:
+                self._resolved_tags.clear()
+            tags = self._resolved_tags[key] = tuple(
+                i["tag"] for i in self.inbounds_by_protocol.get(protocol, [])
+                if i["tag"] not in key[1]
+            )
+        return list(tags)
+
     def get_outbound(self, tag) -> dict:
         for outbound in self['outbounds']:
             if outbound['tag'] == tag:
                 return outbound
 
-    def to_json(self, **json_kwargs):
-        return json.dumps(self, **json_kwargs)
+    def to_json(self, indent: bool = False) -> str:
+        return serialization.dumps(self, indent=indent)
 
     def copy(self):
         return deepcopy(self)
@@ -403,6 +424,6 @@ class XRayConfig(dict):
 
         if DEBUG:
             with open('generated_config-debug.json', 'w') as f:
-                f.write(config.to_json(indent=4))
+                f.write(config.to_json(indent=True))
 
         return config
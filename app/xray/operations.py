@@ -1,14 +1,20 @@
+import time
+from collections import deque
 from functools import lru_cache
-from typing import TYPE_CHECKING
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
 
 from sqlalchemy.exc import SQLAlchemyError
 
 from app import logger, xray
 from app.db import GetDB, crud
 from app.models.node import NodeStatus
-from app.models.user import UserResponse
+from app.models.user import UserSummary
+from app.utils import leader
 from app.utils.concurrency import threaded_function
+from app.xray.config import XRayConfig
 from app.xray.node import XRayNode
+from config import XRAY_JSON
 from xray_api import XRay as XRayAPI
 from xray_api.types.account import Account, XTLSFlows
 
@@ -57,7 +63,10 @@ def _alter_inbound_user(api: XRayAPI, inbound_tag: str, account: Account):
 
 
 def add_user(dbuser: "DBUser"):
-    user = UserResponse.from_orm(dbuser)
+    if not leader.is_leader():
+        return leader.call("add_user", user_id=dbuser.id)
+
+    user = UserSummary.from_orm(dbuser)
     email = f"{dbuser.id}.{dbuser.username}"
 
     for proxy_type, inbound_tags in user.inbounds.items():
@@ -91,6 +100,9 @@ def add_user(dbuser: "DBUser"):
 
 
 def remove_user(dbuser: "DBUser"):
+    if not leader.is_leader():
+        return leader.call("remove_user", user_id=dbuser.id, username=dbuser.username)
+
     email = f"{dbuser.id}.{dbuser.username}"
 
     for inbound_tag in xray.config.inbounds_by_tag:
@@ -101,7 +113,10 @@ def remove_user(dbuser: "DBUser"):
 
 
 def update_user(dbuser: "DBUser"):
-    user = UserResponse.from_orm(dbuser)
+    if not leader.is_leader():
+        return leader.call("update_user", user_id=dbuser.id)
+
+    user = UserSummary.from_orm(dbuser)
     email = f"{dbuser.id}.{dbuser.username}"
 
     active_inbounds = []
@@ -145,7 +160,11 @@ def update_user(dbuser: "DBUser"):
                 _remove_user_from_inbound(node.api, inbound_tag, email)
 
 
+@leader.handler("remove_node")
 def remove_node(node_id: int):
+    if not leader.is_leader():
+        return leader.call("remove_node", node_id=node_id)
+
     if node_id in xray.nodes:
         try:
             xray.nodes[node_id].disconnect()
@@ -192,10 +211,14 @@ global _connecting_nodes
 _connecting_nodes = {}
 
 
+@leader.handler("connect_node")
 @threaded_function
 def connect_node(node_id, config=None):
     global _connecting_nodes
 
+    if not leader.is_leader():
+        return leader.call("connect_node", node_id=node_id)
+
     if _connecting_nodes.get(node_id):
         return
 
@@ -236,8 +259,12 @@ def connect_node(node_id, config=None):
             pass
 
 
+@leader.handler("restart_node")
 @threaded_function
 def restart_node(node_id, config=None):
+    if not leader.is_leader():
+        return leader.call("restart_node", node_id=node_id)
+
     with GetDB() as db:
         dbnode = crud.get_node_by_id(db, node_id)
 
@@ -269,6 +296,90 @@ def restart_node(node_id, config=None):
             pass
 
 
+def restart_core(config_modified: bool = False):
+    """
+    Restarts the main core and the connected nodes with the users of the database,
+    `config_modified` makes the leader reload XRAY_JSON when it's forwarded.
+    """
+    if not leader.is_leader():
+        return leader.call("restart_core", timeout=120, config_modified=config_modified)
+
+    config = xray.config.include_db_users()
+    xray.core.restart(config)
+    for node_id, node in list(xray.nodes.items()):
+        if node.connected:
+            restart_node(node_id, config)
+
+
+@leader.handler("add_user")
+def _forwarded_add_user(user_id: int):
+    with GetDB() as db:
+        dbuser = crud.get_user_by_id(db, user_id)
+        if dbuser:
+            add_user(dbuser)
+
+
+@leader.handler("remove_user")
+def _forwarded_remove_user(user_id: int, username: str):
+    remove_user(SimpleNamespace(id=user_id, username=username))
+
+
+@leader.handler("update_user")
+def _forwarded_update_user(user_id: int):
+    with GetDB() as db:
+        dbuser = crud.get_user_by_id(db, user_id)
+        if dbuser:
+            update_user(dbuser)
+
+
+@leader.handler("restart_core")
+def _forwarded_restart_core(config_modified: bool = False):
+    if config_modified:
+        xray.config = XRayConfig(XRAY_JSON, api_port=xray.config.api_port)
+        xray.hosts.update()
+    restart_core()
+
+
+@leader.handler("core_started")
+def _core_started() -> bool:
+    return xray.core.started
+
+
+@leader.handler("node_connected")
+def _node_connected(node_id: int) -> Optional[bool]:
+    node = xray.nodes.get(node_id)
+    return node.connected if node else None
+
+
+def _follow_logs(logs: deque, alive: Callable[[], bool] = lambda: True) -> Iterator[Optional[str]]:
+    last_yield = time.monotonic()
+    while alive():
+        if logs:
+            yield logs.popleft()
+        elif time.monotonic() - last_yield > 1:
+            yield None  # lets the stream notice when the reader is gone
+        else:
+            time.sleep(0.1)
+            continue
+        last_yield = time.monotonic()
+
+
+@leader.handler("core_logs")
+def _core_logs():
+    with xray.core.get_logs() as logs:
+        yield from _follow_logs(logs)
+
+
+@leader.handler("node_logs")
+def _node_logs(node_id: int):
+    node = xray.nodes.get(node_id)
+    if not node or not node.connected:
+        return
+
+    with node.get_logs() as logs:
+        yield from _follow_logs(logs, lambda: node == xray.nodes.get(node_id))
+
+
 __all__ = [
     "add_user",
     "remove_user",
@@ -276,4 +387,5 @@ __all__ = [
     "remove_node",
     "connect_node",
     "restart_node",
+    "restart_core",
 ]
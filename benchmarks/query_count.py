@@ -0,0 +1,100 @@
+"""
+Counts the queries of listing users the way /api/users does, and fails if it
+grows with the number of users (an N+1 of lazy loaded relationships).
+
+    python benchmarks/query_count.py --users 1000
+
+Users are created in a throwaway sqlite database, the xray binary is still needed.
+tests/test_query_count.py runs the same check with these helpers on every test run.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+if __name__ == "__main__":  # imported by the tests, which have their own database
+    sys.path.insert(0, os.getcwd())
+    os.environ["SQLALCHEMY_DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "db.sqlite3")
+
+from fastapi.encoders import jsonable_encoder  # noqa
+from sqlalchemy import event  # noqa
+
+from app.db import GetDB, crud  # noqa
+from app.db.base import Base, engine  # noqa
+from app.db.models import (JWT, Admin, Proxy, ProxyInbound, User,  # noqa
+                           UserUsageResetLogs)
+from app.models.proxy import ProxyTypes  # noqa
+from app.models.user import UsersResponse  # noqa
+
+# queries of a page, whatever its size
+MAX_QUERIES = 10
+
+
+def populate(users: int):
+    Base.metadata.create_all(engine)
+    with GetDB() as db:
+        admin = Admin(username="admin", hashed_password="", is_sudo=True)
+        inbound = ProxyInbound(tag="VMESS TCP")
+        db.add_all([JWT(), admin, inbound])
+        for i in range(users):
+            db.add(User(
+                username=f"user{i}",
+                admin=admin,
+                used_traffic=i,
+                proxies=[
+                    Proxy(type=ProxyTypes.VMess, settings={"id": "35e4e39c-7d5c-4f4b-8b71-558e4f37ff53"},
+                          excluded_inbounds=[inbound]),
+                    Proxy(type=ProxyTypes.Trojan, settings={"password": f"password{i}"}),
+                ],
+                usage_logs=[UserUsageResetLogs(used_traffic_at_reset=100), UserUsageResetLogs(used_traffic_at_reset=i)],
+            ))
+        db.commit()
+
+
+def count_queries(func) -> int:
+    queries = 0
+
+    def count(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        func()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return queries
+
+
+def list_users(limit: int):
+    with GetDB() as db:
+        users, total = crud.get_users(db, limit=limit, return_with_count=True)
+        page = jsonable_encoder(UsersResponse(users=users, total=total), exclude={"users": {"__all__": {"links"}}})
+    assert len(page["users"]) == limit
+    assert page["users"][-1]["lifetime_used_traffic"] == 100 + 2 * (limit - 1)
+    assert page["users"][-1]["excluded_inbounds"]["vmess"] == ["VMESS TCP"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    populate(args.users)
+
+    failed = False
+    for limit in (10, args.users):
+        start = time.perf_counter()
+        queries = count_queries(lambda: list_users(limit))
+        elapsed = time.perf_counter() - start
+        failed |= queries > MAX_QUERIES
+        print(f"{limit:>6} users: {queries} queries in {elapsed * 1000:.0f}ms")
+
+    if failed:
+        print(f"more than {MAX_QUERIES} queries to list users, a relationship is loaded per user")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Checks that the hot queries of crud and the jobs use the indexes meant for
+them, on the database of SQLALCHEMY_DATABASE_URL (sqlite, mysql or postgresql).
+
+    python benchmarks/query_plans.py
+
+Run it after `alembic upgrade head`, exits with 1 if a query doesn't use its index.
+Planners prefer full scans on tiny tables, sequential scans are disabled for the
+check on postgresql, on mysql run it against a database with realistic data.
+"""
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.getcwd())  # noqa
+
+from sqlalchemy import func, select  # noqa
+from sqlalchemy.ext.compiler import compiles  # noqa
+from sqlalchemy.sql.expression import ClauseElement, Executable  # noqa
+
+from app.db.base import engine  # noqa
+from app.db.models import (NodeUsage, NodeUserUsage, NotificationReminder,  # noqa
+                           User, UserUsageResetLogs)
+from app.models.user import (ReminderType, UserDataLimitResetStrategy,  # noqa
+                             UserStatus)
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, stmt):
+        self.stmt = stmt
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    prefix = {
+        "sqlite": "EXPLAIN QUERY PLAN ",
+        "postgresql": "EXPLAIN (FORMAT JSON) ",
+    }.get(compiler.dialect.name, "EXPLAIN ")
+    return prefix + compiler.process(element.stmt, **kw)
+
+
+def hot_queries():
+    now = datetime.utcnow()
+    timestamp = int(now.timestamp())
+    # (description, statement, index it should use, None for any index)
+    return [
+        ("users of a status (review jobs)",
+         select(User.id).where(User.status == UserStatus.active),
+         "ix_users_status_expire"),
+        ("expired users in a window",
+         select(User.id).where(User.status.in_([UserStatus.expired, UserStatus.limited]),
+                               User.expire != 0, User.expire <= timestamp, User.expire >= timestamp - 86400),
+         "ix_users_status_expire"),
+        ("users count per status of an admin",
+         select(User.status, func.count(User.id)).where(User.admin_id == 1).group_by(User.status),
+         "ix_users_admin_id_status"),
+        ("users due for a usage reset",
+         select(User.id).where(User.status.in_([UserStatus.active, UserStatus.limited]),
+                               User.data_limit_reset_strategy.in_([UserDataLimitResetStrategy.day,
+                                                                   UserDataLimitResetStrategy.week,
+                                                                   UserDataLimitResetStrategy.month,
+                                                                   UserDataLimitResetStrategy.year])),
+         "ix_users_data_limit_reset_strategy_status"),
+        ("usages of a user",
+         select(NodeUserUsage.node_id, NodeUserUsage.used_traffic).where(
+             NodeUserUsage.user_id == 1, NodeUserUsage.created_at.between(now - timedelta(days=30), now)),
+         "ix_node_user_usages_user_id_created_at"),
+        ("usages of the nodes",
+         select(NodeUsage.node_id, NodeUsage.uplink).where(NodeUsage.created_at.between(now - timedelta(days=30), now)),
+         None),
+        ("reminder of a user",
+         select(NotificationReminder.id).where(NotificationReminder.user_id == 1,
+                                               NotificationReminder.type == ReminderType.expiration_date),
+         "ix_notification_reminders_user_id_type"),
+        ("reset logs of a user",
+         select(UserUsageResetLogs.used_traffic_at_reset).where(UserUsageResetLogs.user_id == 1),
+         "ix_user_usage_logs_user_id"),
+    ]
+
+
+def used_indexes(conn, stmt) -> set:
+    rows = conn.execute(Explain(stmt)).all()
+
+    if engine.name == "sqlite":
+        return {m for row in rows for m in re.findall(r"USING (?:COVERING )?INDEX (\w+)", row[-1])}
+
+    if engine.name == "postgresql":
+        plan = rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        names, nodes = set(), [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            if "Index Name" in node:
+                names.add(node["Index Name"])
+            nodes.extend(node.get("Plans", []))
+        return names
+
+    return {row._mapping["key"] for row in rows if row._mapping["key"]}
+
+
+def main():
+    failed = 0
+    with engine.connect() as conn:
+        if engine.name == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+
+        for description, stmt, index in hot_queries():
+            indexes = used_indexes(conn, stmt)
+            ok = bool(indexes) if index is None else index in indexes
+            failed += not ok
+            print(f"{'ok' if ok else 'FAIL':<5} {description:<40} {', '.join(sorted(indexes)) or 'no index'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compares the standard json module with app.utils.serialization (orjson when
+installed) on a page of /api/users and on an xray config with many clients.
+
+    python benchmarks/serialization.py --page-size 1000 --clients 100000
+
+Needs the same environment as the panel itself (xray binary and a database),
+users and clients are generated in memory and nothing is written to the database.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.getcwd())  # noqa
+
+from fastapi.encoders import jsonable_encoder  # noqa
+
+from app import xray  # noqa
+from app.utils import serialization  # noqa
+
+
+def measure(label: str, func, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        size = len(func())
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"  {label:<28} {elapsed * 1000:9.2f}ms  {size / 1024:9.0f}KiB")
+    return elapsed
+
+
+def make_users_page(count: int) -> dict:
+    users = []
+    for i in range(count):
+        user_id = str(uuid.uuid4())
+        users.append({
+            "proxies": {
+                "vmess": {"id": user_id},
+                "vless": {"id": user_id, "flow": ""},
+                "trojan": {"password": user_id[:12], "flow": ""},
+                "shadowsocks": {"password": user_id[:12], "method": "chacha20-ietf-poly1305"},
+            },
+            "expire": 1735689600 + i,
+            "data_limit": 10 ** 10,
+            "data_limit_reset_strategy": "no_reset",
+            "inbounds": {"vmess": ["VMESS TCP"], "vless": ["VLESS TCP REALITY"]},
+            "note": f"note of user {i}",
+            "sub_updated_at": datetime.utcnow(),
+            "sub_last_user_agent": "v2rayNG/1.8.20",
+            "online_at": datetime.utcnow(),
+            "on_hold_expire_duration": None,
+            "on_hold_timeout": None,
+            "auto_delete_in_days": None,
+            "username": f"user{i}",
+            "status": "active",
+            "used_traffic": i * 1024,
+            "lifetime_used_traffic": i * 2048,
+            "created_at": datetime.utcnow(),
+            "links": [f"vless://{user_id}@{n}.example.com:443?security=reality&type=tcp#user{i}" for n in range(4)],
+            "subscription_url": f"/sub/{user_id}",
+            "excluded_inbounds": {"vmess": [], "vless": []},
+            "admin": {"username": "admin", "is_sudo": True, "telegram_id": None, "discord_webhook": None},
+        })
+    return jsonable_encoder({"users": users, "total": count})
+
+
+def make_config(clients: int):
+    config = xray.config.copy()
+    inbound = next(i for i in config["inbounds"] if i.get("settings", {}).get("clients") is not None)
+    inbound["settings"]["clients"] = [
+        {"id": str(uuid.uuid4()), "email": f"{i}.user{i}", "flow": ""} for i in range(clients)
+    ]
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    print("serializer:", "orjson" if serialization.orjson else "json (orjson is not installed)")
+
+    page = make_users_page(args.page_size)
+    print(f"/api/users page of {args.page_size} users")
+    before = measure("json.dumps (JSONResponse)", lambda: json.dumps(
+        page, ensure_ascii=False, separators=(",", ":")).encode(), args.rounds)
+    after = measure("serialization.dumpb", lambda: serialization.dumpb(page), args.rounds)
+    print(f"  {before / after:.1f}x faster")
+
+    config = make_config(args.clients)
+    print(f"xray config with {args.clients} clients")
+    before = measure("json.dumps", lambda: json.dumps(config), args.rounds)
+    after = measure("XRayConfig.to_json", config.to_json, args.rounds)
+    print(f"  {before / after:.1f}x faster")
+
+    print("compact json subscriptions (SUB_COMPACT_JSON)")
+    before = measure("json.dumps", lambda: json.dumps(config, separators=(",", ":")), args.rounds)
+    after = measure("serialization.dumps", lambda: serialization.dumps(config), args.rounds)
+    print(f"  {before / after:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
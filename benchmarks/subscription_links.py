@@ -0,0 +1,75 @@
+"""
+Measures share link generation for many users over many hosts.
+
+    python benchmarks/subscription_links.py --hosts 100 --users 10000
+
+Needs the same environment as the panel itself (xray binary and a database),
+hosts are generated in memory and nothing is written to the database.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())  # noqa
+
+from app import xray  # noqa
+from app.subscription import V2rayShareLink  # noqa
+from app.subscription.cache import bump_version  # noqa
+from app.subscription.share import (process_inbounds_and_tags,  # noqa
+                                    setup_format_variables)
+from app.models.proxy import ProxySettings, ProxyTypes  # noqa
+
+
+def make_hosts(count: int):
+    tags = list(xray.config.inbounds_by_tag)
+    xray.hosts.clear()
+    for tag in tags:
+        xray.hosts[tag] = []
+    for i in range(count):
+        xray.hosts[tags[i % len(tags)]].append({
+            "remark": f"Host {i} ({{USERNAME}}) [{{PROTOCOL}} - {{TRANSPORT}}] {{DATA_LEFT}}",
+            "address": f"{i}.*.example.com",
+            "port": None,
+            "path": None,
+            "sni": [],
+            "host": [],
+            "alpn": "",
+            "fingerprint": "",
+            "tls": None,
+            "allowinsecure": None,
+            "mux_enable": False,
+            "fragment_setting": None,
+            "random_user_agent": False,
+        })
+    bump_version("hosts")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10000)
+    args = parser.parse_args()
+
+    make_hosts(args.hosts)
+    inbounds = {
+        protocol: [i["tag"] for i in xray.config.inbounds_by_protocol.get(protocol.value, [])]
+        for protocol in ProxyTypes
+    }
+    proxies = {protocol: ProxySettings.from_dict(protocol, {}) for protocol in inbounds}
+
+    links = 0
+    start = time.perf_counter()
+    for i in range(args.users):
+        format_variables = setup_format_variables({
+            "username": f"user{i}", "status": "active", "used_traffic": i, "data_limit": 10 ** 10,
+        })
+        links += len(process_inbounds_and_tags(inbounds, proxies, format_variables, conf=V2rayShareLink()))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.users} users x {args.hosts} hosts: {links} links in {elapsed:.2f}s "
+          f"({args.users / elapsed:.0f} users/s, {links / elapsed:.0f} links/s)")
+
+
+if __name__ == "__main__":
+    main()
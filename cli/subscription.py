@@ -1,11 +1,20 @@
-import typer
+import io
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from enum import Enum
-from typing import Optional
+from typing import Iterator, List, Optional, Tuple
+
+import typer
 from rich.console import Console
 
-from app.db import GetDB
-from app.models.user import UserResponse
-from app.subscription.share import generate_subscription
+from app.db import GetDB, crud, engine
+from app.db.models import Admin, User
+from app.models.user import UserResponse, UserSummary
+from app.subscription.share import generate_subscription, get_compiled_hosts
+from app.utils.system import readable_size
 
 from . import utils
 
@@ -16,6 +25,20 @@ console = Console()
 class ConfigFormat(str, Enum):
     v2ray = "v2ray"
     clash = "clash"
+    clash_meta = "clash-meta"
+    sing_box = "sing-box"
+    outline = "outline"
+    v2ray_json = "v2ray-json"
+
+
+FILE_EXTENSIONS = {
+    "v2ray": "txt",
+    "clash": "yaml",
+    "clash-meta": "yaml",
+    "sing-box": "json",
+    "outline": "json",
+    "v2ray-json": "json",
+}
 
 
 @app.command(name="get-link")
@@ -55,7 +78,7 @@ def get_config(
     with GetDB() as db:
         user: UserResponse = UserResponse.from_orm(utils.get_user(db, username))
         conf: str = generate_subscription(
-            user=user, config_format=config_format.name, as_base64=as_base64
+            user=user, config_format=config_format.value, as_base64=as_base64, reverse=False
         )
 
         if output_file:
@@ -73,3 +96,139 @@ def get_config(
                 auto_exit=False
             )
             utils.paginate(conf)
+
+
+def _init_export_worker():
+    # connections opened by the parent process must not be shared
+    engine.dispose(close=False)
+    # hosts are compiled once per worker and reused for all of its users
+    get_compiled_hosts()
+
+
+def _render_users(user_ids: List[int], config_format: str, as_base64: bool) -> List[Tuple[str, bytes]]:
+    with GetDB() as db:
+        dbusers = crud.get_user_queryset(db).filter(User.id.in_(user_ids)).all()
+        return [
+            (
+                dbuser.username,
+                generate_subscription(
+                    user=UserSummary.from_orm(dbuser),
+                    config_format=config_format,
+                    as_base64=as_base64,
+                    reverse=False
+                ).encode()
+            )
+            for dbuser in dbusers
+        ]
+
+
+def _iter_user_id_chunks(
+    chunk_size: int,
+    status: Optional[crud.UserStatus],
+    admins: Optional[List[str]],
+    usernames: Optional[List[str]]
+) -> Iterator[List[int]]:
+    with GetDB() as db:
+        query = db.query(User.id)
+        if status:
+            query = query.filter(User.status == status)
+        if admins:
+            query = query.filter(User.admin.has(Admin.username.in_(admins)))
+        if usernames:
+            query = query.filter(User.username.in_(usernames))
+
+        chunk = []
+        for (user_id,) in query.order_by(User.id).yield_per(chunk_size):
+            chunk.append(user_id)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+@app.command(name="export")
+def export(
+    config_format: ConfigFormat = typer.Option(..., *utils.FLAGS["format"], prompt=True),
+    output_dir: Optional[str] = typer.Option(
+        None, "--output-dir", "-d", help="Writes a file per user in this directory"
+    ),
+    tar_file: Optional[str] = typer.Option(
+        None, "--tar", help="Writes a tar archive (gzipped for .gz/.tgz names), \"-\" streams it to stdout"
+    ),
+    as_base64: bool = typer.Option(
+        False, "--base64", is_flag=True, help="Encodes output in base64 format if present"
+    ),
+    status: Optional[crud.UserStatus] = typer.Option(None, *utils.FLAGS["status"]),
+    admins: Optional[List[str]] = typer.Option(None, *utils.FLAGS["admin"], help="Only users of these admin(s)"),
+    usernames: Optional[List[str]] = typer.Option(None, *utils.FLAGS["username"], help="Only these user(s)"),
+    workers: int = typer.Option(os.cpu_count() or 1, "--workers", "-w", help="Number of worker processes"),
+    chunk_size: int = typer.Option(200, "--chunk-size", help="Number of users rendered per task"),
+):
+    """
+    Exports subscription configs of all (or the filtered) users.
+
+    Users are read from the database in chunks and rendered by a pool of worker processes,
+      each config is written as "<username>.<ext>" to the output directory or the tar archive.
+    """
+    if bool(output_dir) == bool(tar_file):
+        utils.error("Exactly one of --output-dir and --tar is required.")
+
+    # progress goes to stderr so the archive can be streamed to stdout
+    progress = Console(stderr=True)
+    extension = FILE_EXTENSIONS[config_format.value]
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+        def write(username: str, body: bytes):
+            with open(os.path.join(output_dir, f"{username}.{extension}"), "wb") as f:
+                f.write(body)
+    else:
+        mode = "w|gz" if tar_file.endswith((".gz", ".tgz")) else "w|"
+        if tar_file == "-":
+            archive = tarfile.open(fileobj=sys.stdout.buffer, mode=mode)
+        else:
+            archive = tarfile.open(tar_file, mode=mode)
+        now = time.time()
+
+        def write(username: str, body: bytes):
+            info = tarfile.TarInfo(f"{username}.{extension}")
+            info.size = len(body)
+            info.mtime = now
+            archive.addfile(info, io.BytesIO(body))
+
+    start_time = time.perf_counter()
+    exported = exported_bytes = 0
+
+    def collect(futures: set):
+        nonlocal exported, exported_bytes
+        for future in futures:
+            for username, body in future.result():
+                write(username, body)
+                exported += 1
+                exported_bytes += len(body)
+
+        elapsed = time.perf_counter() - start_time
+        progress.print(f"{exported} users exported, {exported / elapsed:.0f} users/s", highlight=False)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker) as executor:
+        pending = set()
+        chunks = _iter_user_id_chunks(chunk_size, status, admins, usernames)
+        for chunk in chunks:
+            pending.add(executor.submit(_render_users, chunk, config_format.value, as_base64))
+            # keep a bounded number of chunks in flight
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        collect(pending)
+
+    if tar_file:
+        archive.close()
+
+    elapsed = time.perf_counter() - start_time
+    progress.print(
+        f"[green]Exported {exported} users ({readable_size(exported_bytes)})"
+        f" in {elapsed:.2f} seconds, {exported / elapsed:.0f} users/s[/green]"
+    )
@@ -0,0 +1,39 @@
+import logging
+import signal
+import threading
+
+import anyio
+
+from config import CACHE_REDIS_URL, DEBUG, STANDALONE_WORKER
+
+from . import utils
+
+
+def worker():
+    """
+    Runs the jobs and the Xray core for the API started with STANDALONE_WORKER
+
+    The API forwards its core and node operations to it through LEADER_SOCKET,
+    another worker started meanwhile takes over once this one exits.
+    """
+    if not STANDALONE_WORKER:
+        utils.error("STANDALONE_WORKER isn't enabled, the API runs the jobs and Xray core itself.")
+    if not CACHE_REDIS_URL:
+        utils.error("CACHE_REDIS_URL is required with STANDALONE_WORKER, the processes share their caches through it.")
+
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO, format="%(levelname)s: %(message)s")
+    logging.getLogger("apscheduler").setLevel(logging.DEBUG if DEBUG else logging.WARNING)
+
+    from app import app, scheduler
+    from app.utils import leader
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    scheduler.start()
+    leader.campaign_until_elected(scheduler)
+    stop.wait()
+
+    # the same shutdown as the API's, stops the core and the scheduler and resigns
+    anyio.run(app.router.shutdown)
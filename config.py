@@ -1,3 +1,5 @@
+import json
+
 from decouple import config
 from dotenv import load_dotenv
 
@@ -5,6 +7,14 @@ load_dotenv()
 
 
 SQLALCHEMY_DATABASE_URL = config("SQLALCHEMY_DATABASE_URL", default="sqlite:///db.sqlite3")
+# comma separated replicas of the database serving the subscriptions, usages and lists while
+# they're at most REPLICA_MAX_LAG seconds behind, the primary serves them otherwise
+SQLALCHEMY_REPLICA_URLS = config(
+    "SQLALCHEMY_REPLICA_URLS",
+    default="",
+    cast=lambda v: [url.strip() for url in v.split(',') if url.strip()]
+)
+REPLICA_MAX_LAG = config("REPLICA_MAX_LAG", cast=float, default=5)
 
 
 UVICORN_HOST = config("UVICORN_HOST", default="0.0.0.0")
@@ -12,6 +22,19 @@ UVICORN_PORT = config("UVICORN_PORT", cast=int, default=8000)
 UVICORN_UDS = config("UVICORN_UDS", default=None)
 UVICORN_SSL_CERTFILE = config("UVICORN_SSL_CERTFILE", default=None)
 UVICORN_SSL_KEYFILE = config("UVICORN_SSL_KEYFILE", default=None)
+# with more than one worker, the jobs and the xray core run on the worker elected as the leader
+# and the others forward core and node operations to it through the LEADER_SOCKET unix socket,
+# CACHE_REDIS_URL is required then
+UVICORN_WORKERS = config("UVICORN_WORKERS", cast=int, default=1)
+LEADER_SOCKET = config("LEADER_SOCKET", default="/var/lib/marzban/leader.socket")
+# run the jobs and the xray core in a separate process started with `marzban-cli worker` instead,
+# CACHE_REDIS_URL is required then
+STANDALONE_WORKER = config("STANDALONE_WORKER", cast=bool, default=False)
+
+# compress responses bigger than RESPONSE_COMPRESSION_MIN_SIZE bytes with "gzip" or "br"
+# (needs the brotli package), disabled by default as some subscription clients mishandle Content-Encoding
+RESPONSE_COMPRESSION = config("RESPONSE_COMPRESSION", default="")
+RESPONSE_COMPRESSION_MIN_SIZE = config("RESPONSE_COMPRESSION_MIN_SIZE", default=1024, cast=int)
 
 
 DEBUG = config("DEBUG", default=False, cast=bool)
@@ -42,6 +65,18 @@ TELEGRAM_LOGGER_CHANNEL_ID = config("TELEGRAM_LOGGER_CHANNEL_ID", cast=int, defa
 TELEGRAM_DEFAULT_VLESS_FLOW = config("TELEGRAM_DEFAULT_VLESS_FLOW", default="")
 
 JWT_ACCESS_TOKEN_EXPIRE_MINUTES = config("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", cast=int, default=1440)
+# number of verified tokens kept in memory, and seconds an admin is cached per token,
+# the panel drops it when the admin changes, without CACHE_REDIS_URL changes made with
+# marzban-cli only show up once it expires
+AUTH_CACHE_SIZE = config("AUTH_CACHE_SIZE", cast=int, default=10000)
+ADMIN_CACHE_TTL = config("ADMIN_CACHE_TTL", cast=int, default=30)
+# users count per status kept in memory and reloaded every n seconds, 0 counts them on every request,
+# changes made by other processes only show up after a reload
+USERS_COUNT_CACHE_TTL = config("USERS_COUNT_CACHE_TTL", cast=int, default=0)
+# share the caches of hosts, admins and rendered subscriptions between processes through redis,
+# e.g. redis://127.0.0.1:6379/0, and drop them in every process when they change,
+# required with more than one UVICORN_WORKERS or STANDALONE_WORKER
+CACHE_REDIS_URL = config("CACHE_REDIS_URL", default="") or config("SUB_CACHE_REDIS_URL", default="")
 
 CUSTOM_TEMPLATES_DIRECTORY = config("CUSTOM_TEMPLATES_DIRECTORY", default=None)
 CLASH_SUBSCRIPTION_TEMPLATE = config("CLASH_SUBSCRIPTION_TEMPLATE", default="clash/default.yml")
@@ -59,6 +94,9 @@ USE_CUSTOM_JSON_DEFAULT = config("USE_CUSTOM_JSON_DEFAULT", default=False, cast=
 USE_CUSTOM_JSON_FOR_V2RAYN = config("USE_CUSTOM_JSON_FOR_V2RAYN", default=False, cast=bool)
 USE_CUSTOM_JSON_FOR_V2RAYNG = config("USE_CUSTOM_JSON_FOR_V2RAYNG", default=False, cast=bool)
 USE_CUSTOM_JSON_FOR_STREISAND = config("USE_CUSTOM_JSON_FOR_STREISAND", default=False, cast=bool)
+# extra subscription clients as a json list, checked before the built-in ones, e.g.
+# [{"pattern": "^MyClient", "format": "clash-meta"}]
+SUB_CLIENT_RULES = config("SUB_CLIENT_RULES", default="[]", cast=json.loads)
 
 ACTIVE_STATUS_TEXT = config("ACTIVE_STATUS_TEXT", default="Active")
 EXPIRED_STATUS_TEXT = config("EXPIRED_STATUS_TEXT", default="Expired")
@@ -82,6 +120,9 @@ WEBHOOK_ADDRESS = config(
     cast=lambda v: [address.strip() for address in v.split(',')] if v else []
 )
 WEBHOOK_SECRET = config("WEBHOOK_SECRET", default=None)
+# seconds to wait for a webhook to answer, and notifications posted to it at most in a request
+WEBHOOK_TIMEOUT = config("WEBHOOK_TIMEOUT", cast=float, default=10)
+WEBHOOK_BATCH_SIZE = config("WEBHOOK_BATCH_SIZE", cast=int, default=100)
 
 # recurrent notifications
 
@@ -103,6 +144,16 @@ SUB_UPDATE_INTERVAL = config("SUB_UPDATE_INTERVAL", default="12")
 SUB_SUPPORT_URL = config("SUB_SUPPORT_URL", default="https://t.me/")
 SUB_PROFILE_TITLE = config("SUB_PROFILE_TITLE", default="Subscription")
 RANDOMIZE_SUBSCRIPTION_CONFIGS = config("RANDOMIZE_SUBSCRIPTION_CONFIGS", default=False, cast=bool)
+# json subscriptions (sing-box, v2ray-json) without indentation
+SUB_COMPACT_JSON = config("SUB_COMPACT_JSON", default=False, cast=bool)
+
+# rendered subscriptions cache, set SUB_CACHE_TTL (in seconds) to enable it
+SUB_CACHE_TTL = config("SUB_CACHE_TTL", default=0, cast=int)
+SUB_CACHE_MAX_SIZE = config("SUB_CACHE_MAX_SIZE", default=10000, cast=int)
+# how long user versions used for subscription ETags are cached, 0 to always query them
+SUB_STAMP_CACHE_TTL = config("SUB_STAMP_CACHE_TTL", default=10, cast=int)
+# subscription fetch times and user agents are buffered and written every n seconds
+SUB_UPDATES_FLUSH_INTERVAL = config("SUB_UPDATES_FLUSH_INTERVAL", default=5, cast=int)
 
 # discord webhook log
 DISCORD_WEBHOOK_URL = config("DISCORD_WEBHOOK_URL", default="")
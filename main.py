@@ -6,13 +6,13 @@ from config import (
     UVICORN_PORT,
     UVICORN_UDS,
     UVICORN_SSL_CERTFILE,
-    UVICORN_SSL_KEYFILE
+    UVICORN_SSL_KEYFILE,
+    UVICORN_WORKERS
 )
 import logging
 
 if __name__ == "__main__":
-    # Do NOT change workers count for now
-    # multi-workers support isn't implemented yet for APScheduler and XRay module
+    # only the worker elected as the leader runs the jobs and the xray core (app.utils.leader)
     try:
         uvicorn.run(
             "main:app",
@@ -21,7 +21,7 @@ if __name__ == "__main__":
             uds=(None if DEBUG else UVICORN_UDS),
             ssl_certfile=UVICORN_SSL_CERTFILE,
             ssl_keyfile=UVICORN_SSL_KEYFILE,
-            workers=1,
+            workers=UVICORN_WORKERS,
             reload=DEBUG,
             log_level=logging.DEBUG if DEBUG else logging.INFO
         )
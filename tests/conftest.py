@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# the tests run on a throwaway sqlite database, set before the panel is imported
+os.environ["SQLALCHEMY_DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "db.sqlite3")
@@ -0,0 +1,37 @@
+"""
+Listing users must take the same number of queries however many users there are,
+a relationship loaded per user (an N+1) makes these fail.
+
+    python -m pytest tests
+
+The xray binary is still needed.
+"""
+import pytest
+
+from app.db import GetDB
+from app.db.base import Base, engine
+from app.db.models import User
+from benchmarks.query_count import count_queries, list_users, populate
+
+USERS = 50
+
+
+@pytest.fixture(scope="module", autouse=True)
+def users():
+    populate(USERS)
+    yield
+    Base.metadata.drop_all(engine)
+
+
+def test_listing_users_takes_a_fixed_number_of_queries():
+    list_users(1)  # loads what's cached once per process, e.g. the jwt secret
+    assert count_queries(lambda: list_users(USERS)) == count_queries(lambda: list_users(1))
+
+
+def test_lifetime_used_traffic_is_loaded_with_the_user():
+    with GetDB() as db:
+        user = db.query(User).filter(User.username == "user3").first()
+        db.expunge(user)
+
+    # loaded without crud.get_user_queryset, and read once the session is gone
+    assert user.lifetime_used_traffic == 100 + 3 + 3